@@ -0,0 +1,93 @@
+"""Parity check and micro-benchmark for elmerbot.reviews.parse_date.
+
+The reference is the original parser with its final arrow round-trip replaced by strict datetime parsing, since what
+arrow makes of "MM/DD/YYYY" strings depends on the installed arrow version. With elmerbot installed, run:
+
+    python benchmarks/bench_dates.py [rows]
+"""
+import datetime
+import random
+import sys
+import time
+from elmerbot import reviews
+from sheet import generate, random_date
+
+
+def reference_parse_date(date):
+    try:
+        divider = "/"
+        if "-" in date:
+            divider = "-"
+        elif "." in date:
+            divider = "."
+        divider = "/" if "/" in date else "-"
+        m, d, y = [int(f) for f in date.replace(divider * 2, divider).split(divider)]
+        if y < 2000:
+            y += 2000
+        clean_str = "{}/{}/{}".format(str(m).zfill(2), str(d).zfill(2), y)
+        return datetime.datetime.strptime(clean_str, "%m/%d/%Y").strftime("%Y-%m-%d")
+    except:
+        return "2000-01-01"
+
+
+def known_difference(date):
+    """Inputs where the new parser is intentionally different from the reference."""
+    # The reference overwrites its divider choice, so dates using "." always fell back to 2000-01-01
+    if "." in date and "/" not in date:
+        return True
+    # Four digit years before 2000 were shifted by 2000 years
+    year = date.replace("/", "-").replace(".", "-").rstrip("-").rsplit("-", 1)[-1].strip()
+    return year.isdigit() and len(year) == 4 and int(year) < 2000
+
+
+def parity(samples):
+    mismatches = []
+    for date in samples:
+        expected = reference_parse_date(date)
+        actual = reviews.parse_date(date)
+        if expected != actual and not known_difference(date):
+            mismatches.append((date, expected, actual))
+    return mismatches
+
+
+def ingest_rate(text, rows, date_parser):
+    original = reviews.parse_date
+    reviews.parse_date = date_parser
+    try:
+        start = time.perf_counter()
+        reviews.parse_reviews(text)
+        return rows / (time.perf_counter() - start)
+    finally:
+        reviews.parse_date = original
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(1234)
+
+    samples = [random_date(rng) for _ in range(50000)]
+    mismatches = parity(samples)
+    print(f"Parity: {len(samples) - len(mismatches)}/{len(samples)} samples match the reference")
+    for date, expected, actual in mismatches[:20]:
+        print(f"  {date!r}: reference {expected}, parse_date {actual}")
+
+    start = time.perf_counter()
+    for date in samples:
+        reference_parse_date(date)
+    reference_rate = len(samples) / (time.perf_counter() - start)
+    reviews.parse_date.cache_clear()
+    start = time.perf_counter()
+    for date in samples:
+        reviews.parse_date(date)
+    fast_rate = len(samples) / (time.perf_counter() - start)
+    print(f"parse_date: {fast_rate:,.0f} dates/sec (reference {reference_rate:,.0f} dates/sec)")
+
+    text = generate(rows)
+    reviews.parse_date.cache_clear()
+    print(f"Ingest with parse_date: {ingest_rate(text, rows, reviews.parse_date):,.0f} rows/sec")
+    print(f"Ingest with reference parser: {ingest_rate(text, rows, reference_parse_date):,.0f} rows/sec")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
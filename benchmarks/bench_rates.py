@@ -0,0 +1,66 @@
+"""Parity check and micro-benchmark for elmerbot.rates, fully offline: a StaticProvider stands in for the exchange
+rate API, and a FileProvider reading the same rates from a JSON file has to produce the same matrix. With elmerbot
+installed, run:
+
+    python benchmarks/bench_rates.py [conversions]
+"""
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from elmerbot.rates import FileProvider, RateService, StaticProvider, provider_from_settings
+
+
+CURRENCIES = ["USD", "EUR", "GBP", "SGD", "CAD", "AUD", "DKK", "HKD", "NZD"]
+# Units per US dollar
+RATES = {"EUR": 0.92, "GBP": 0.79, "SGD": 1.34, "CAD": 1.36, "AUD": 1.52, "DKK": 6.87, "HKD": 7.82, "NZD": 1.66}
+
+
+def parity(matrix, base_rates):
+    """Cross rates that differ from converting through the base currency by hand."""
+    units = dict(base_rates, USD=1.0)
+    mismatches = []
+    for source in CURRENCIES:
+        for target in CURRENCIES:
+            expected = units[target] / units[source]
+            actual = matrix.rate(source, target)
+            if not math.isclose(expected, actual, rel_tol=1e-12):
+                mismatches.append((source, target, expected, actual))
+    return mismatches
+
+
+def main():
+    conversions = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(1234)
+
+    matrix = RateService(StaticProvider(RATES), CURRENCIES).refresh()
+    mismatches = parity(matrix, RATES)
+    # The same rates against another base must give the same cross rates
+    eur_rates = {currency: rate / RATES["EUR"] for currency, rate in dict(RATES, USD=1.0).items()}
+    rebased = RateService(StaticProvider(eur_rates, "EUR"), CURRENCIES).refresh()
+    mismatches += parity(rebased, RATES)
+    with tempfile.TemporaryDirectory(prefix="elmerrates-") as workdir:
+        path = os.path.join(workdir, "rates.json")
+        with open(path, "w") as fout:
+            json.dump({"base": "USD", "rates": RATES}, fout)
+        provider = provider_from_settings({"rates_file": path})
+        assert isinstance(provider, FileProvider)
+        mismatches += parity(RateService(provider, CURRENCIES).refresh(), RATES)
+    print(f"Parity: {len(mismatches)} mismatched cross rates")
+    for source, target, expected, actual in mismatches[:20]:
+        print(f"  {source}->{target}: expected {expected}, got {actual}")
+
+    samples = [(rng.uniform(1, 500), rng.choice(CURRENCIES)) for _ in range(conversions)]
+    start = time.perf_counter()
+    for amount, source in samples:
+        matrix.convert(amount, source)
+    elapsed = time.perf_counter() - start
+    print(f"convert: {conversions / elapsed:,.0f} conversion tables/sec ({elapsed / conversions * 1e6:.2f} us each)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""Benchmarks for ReviewData against synthetic sheets (see sheet.py), timing each operation and measuring its peak
+traced memory. With elmerbot installed, run:
+
+    python benchmarks/bench_reviews.py --sizes 10000 100000 1000000 -o results.json
+    python benchmarks/bench_reviews.py --compare results.json
+
+Results are written as JSON. --compare runs again (or loads --results) and prints the change against an earlier run.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from elmerbot import reviews
+from elmerbot.analytics import RatingsEngine
+from elmerbot.executor import WorkPool
+from elmerbot.snapshot import load_snapshot
+from sheet import generate
+
+
+class SheetResponse(object):
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+        self.headers = {}
+
+
+class LocalReviewData(reviews.ReviewData):
+    """ReviewData that "downloads" a local sheet, so _reload runs exactly as in production minus the network."""
+
+    def __init__(self, text, cache_path):
+        super(LocalReviewData, self).__init__(cache_path=cache_path, pool=WorkPool("thread", 1))
+        self._text = text
+
+    def _fetch(self):
+        return SheetResponse(self._text)
+
+
+def typo(rng, name):
+    """A search pattern like people type them: lower case, partial and sometimes with a typo."""
+    words = name.lower().split()
+    pattern = " ".join(words[: rng.randint(1, len(words))])
+    if len(pattern) > 3 and rng.random() < 0.3:
+        pos = rng.randrange(len(pattern) - 1)
+        pattern = pattern[:pos] + pattern[pos + 1] + pattern[pos] + pattern[pos + 2 :]
+    return pattern
+
+
+def measure(func, repeat=1, memory=True):
+    """(seconds per call, peak traced bytes). Memory is measured in a separate pass since tracing slows things down."""
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    seconds = (time.perf_counter() - start) / repeat
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def bench_size(rows, args, workdir):
+    rng = random.Random(args.seed)
+    results = []
+
+    def record(name, func, repeat=1, ops=1):
+        seconds, peak = measure(func, repeat, not args.no_memory)
+        results.append(
+            {
+                "rows": rows,
+                "benchmark": name,
+                "seconds": seconds,
+                "ops": ops,
+                "us_per_op": seconds / ops * 1e6,
+                "peak_bytes": peak,
+            }
+        )
+        memory = f", peak {peak / 2 ** 20:.1f} MiB" if peak is not None else ""
+        print(f"  {name:<22} {seconds * 1000:10.2f} ms  ({seconds / ops * 1e6:9.1f} us/op{memory})")
+
+    print(f"{rows:,} rows")
+    text = generate(rows, args.seed)
+    cache_path = os.path.join(workdir, f"reviews-{rows}.snapshot")
+
+    def ingest():
+        # Without a snapshot file _reload has to parse, like a first start or a changed sheet
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        reviews.parse_date.cache_clear()
+        LocalReviewData(text, cache_path)._reload()
+
+    # Parse, build the snapshot (index, stats) and write the snapshot file, as after a real download
+    record("ingest", ingest)
+    data = LocalReviewData(text, cache_path)
+    data._reload()
+    snapshot = data._snapshot
+    print(f"  {len(snapshot.names):,} whiskies")
+
+    def load():
+        snapshot_file = load_snapshot(cache_path)
+        reviews.ReviewSnapshot(snapshot_file.store, snapshot_file.stats, snapshot_file.index)
+
+    record("snapshot_load", load)
+
+    names = snapshot.names
+    patterns = [typo(rng, names[rng.randrange(len(names))]) for _ in range(args.queries)]
+
+    def search_cold():
+        data._search_cache.clear()
+        for pattern in patterns:
+            data.search(pattern)
+
+    def search_cached():
+        for pattern in patterns:
+            data.search(pattern)
+
+    record("search", search_cold, ops=len(patterns))
+    record("search_cached", search_cached, repeat=3, ops=len(patterns))
+
+    ids = [rng.randint(1, len(names)) for _ in range(args.lookups)]
+
+    def find():
+        for whisky_id in ids:
+            data.find(whisky_id)
+
+    def most_recent():
+        for whisky_id in ids:
+            data.most_recent(whisky_id=whisky_id)
+
+    record("find", find, repeat=3, ops=len(ids))
+    record("most_recent", most_recent, repeat=3, ops=len(ids))
+
+    # The stats behind !info/!stats/!top: global mean and deviation plus the per-group arrays, then typical queries
+    record("stats", lambda: RatingsEngine(snapshot.store))
+
+    def stats_queries():
+        for whisky_id in ids:
+            snapshot.analytics.whisky_stats(whisky_id - 1)
+        snapshot.analytics.top(10, 5)
+
+    record("stats_queries", stats_queries, ops=len(ids) + 1)
+    return results
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "queries": args.queries,
+        "lookups": args.lookups,
+    }
+
+
+def compare(previous, current):
+    before = {(result["rows"], result["benchmark"]): result for result in previous["results"]}
+    print(f"Compared to {previous['meta'].get('commit')} ({previous['meta'].get('time')}):")
+    for result in current["results"]:
+        old = before.get((result["rows"], result["benchmark"]))
+        if old is None:
+            continue
+        # Per operation, so runs with different --queries/--lookups still compare
+        change = (result["us_per_op"] / old["us_per_op"] - 1) * 100 if old["us_per_op"] else 0
+        line = f"  {result['rows']:>9,} {result['benchmark']:<22} time/op {change:+7.1f}%"
+        if result["peak_bytes"] and old["peak_bytes"]:
+            line += f"  peak memory {(result['peak_bytes'] / old['peak_bytes'] - 1) * 100:+7.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark review data ingest, loading, search and lookups")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Sheet sizes in rows")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--queries", type=int, default=100, help="Search patterns per size")
+    parser.add_argument("--lookups", type=int, default=2000, help="Whisky ids looked up per size")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("-o", "--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Earlier results JSON file to compare against")
+    parser.add_argument("--results", help="Compare this results file instead of running the benchmarks")
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results) as fin:
+            current = json.load(fin)
+    else:
+        current = {"meta": metadata(args), "results": []}
+        with tempfile.TemporaryDirectory(prefix="elmerbench-") as workdir:
+            for rows in args.sizes:
+                current["results"].extend(bench_size(rows, args, workdir))
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(current, fout, indent=2)
+    if args.compare:
+        with open(args.compare) as fin:
+            compare(json.load(fin), current)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
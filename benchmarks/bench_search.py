@@ -0,0 +1,64 @@
+"""Trigram shortlist benchmark: how long TrigramIndex.candidates takes as the catalogue grows, and how often searching
+the shortlist gives the same top results as scoring every name. With elmerbot installed, run:
+
+    python benchmarks/bench_search.py [--sizes 2000 20000 200000] [--queries 50]
+
+The full scan scores every name per query, so the parity pass is slow on large sizes; --no-parity skips it.
+"""
+import argparse
+import random
+import sys
+import time
+from fuzzywuzzy import process
+from elmerbot.index import MAX_CANDIDATES, TrigramIndex
+from elmerbot.reviews import search_names
+from bench_reviews import typo
+from sheet import whisky_names
+
+
+def full_scan(names, pattern, limit):
+    results = process.extractBests(pattern, dict(enumerate(names)), processor=lambda x: x, limit=limit, score_cutoff=70)
+    return tuple((result, pos + 1, conf) for result, conf, pos in results)
+
+
+def bench_size(size, args):
+    rng = random.Random(args.seed)
+    names = whisky_names(rng, size)
+    index = TrigramIndex.build(names)
+    patterns = [typo(rng, rng.choice(names)) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for pattern in patterns:
+            index.candidates(pattern, args.candidates)
+    elapsed = (time.perf_counter() - start) / args.repeat / len(patterns)
+    print(f"{size:>9,} names: candidates {elapsed * 1000:.2f} ms per query", flush=True)
+    if args.no_parity:
+        return
+
+    top1 = top5 = 0
+    for pattern in patterns:
+        expected = full_scan(names, pattern, 5)
+        actual = search_names(names, index, (pattern, 5, None), args.candidates)
+        # Compare by score so names that tie with the full scan's pick don't count as a miss
+        top1 += [conf for _, _, conf in expected[:1]] == [conf for _, _, conf in actual[:1]]
+        top5 += [conf for _, _, conf in expected] == [conf for _, _, conf in actual]
+    print(f"{'':>16}top-1 matches full scan {top1}/{len(patterns)}, top-5 {top5}/{len(patterns)}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark trigram candidate selection against a full scan")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 20000, 200000], help="Catalogue sizes")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--queries", type=int, default=50, help="Search patterns per size")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing passes over the patterns")
+    parser.add_argument("--candidates", type=int, default=MAX_CANDIDATES, help="Shortlist size")
+    parser.add_argument("--no-parity", action="store_true", help="Skip the full scan comparison")
+    args = parser.parse_args()
+    for size in args.sizes:
+        bench_size(size, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
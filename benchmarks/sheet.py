@@ -0,0 +1,169 @@
+"""Synthetic review spreadsheet in the real column layout, for benchmarks.
+
+Whisky and reviewer popularity follow a Zipf-like curve like the real sheet, and ratings, prices and dates come in the
+same messy formats people actually type. Output only depends on rows and seed. To write one out:
+
+    python benchmarks/sheet.py 100000 -o sheet.csv
+"""
+import argparse
+import csv
+import io
+import itertools
+import random
+import sys
+
+
+HEADER = [
+    "Timestamp",
+    "Whisky Name",
+    "Reviewer's Reddit Username",
+    "Link To Reddit Review",
+    "Reviewer Rating",
+    "Whisky Region or Style",
+    "Full Bottle Price Paid",
+    "Date of Review",
+]
+DISTILLERIES = [
+    "Ardbeg",
+    "Lagavulin",
+    "Laphroaig",
+    "Talisker",
+    "Springbank",
+    "Glenfarclas",
+    "Glendronach",
+    "Macallan",
+    "Highland Park",
+    "Bruichladdich",
+    "Bunnahabhain",
+    "Caol Ila",
+    "Kilchoman",
+    "Balvenie",
+    "Glenlivet",
+    "Buffalo Trace",
+    "Eagle Rare",
+    "George T. Stagg",
+    "Blanton's",
+    "Wild Turkey",
+    "Four Roses",
+    "Elijah Craig",
+    "Old Forester",
+    "Knob Creek",
+    "Booker's",
+    "Redbreast",
+    "Yamazaki",
+    "Hakushu",
+    "Kavalan",
+    "Amrut",
+]
+EXPRESSIONS = [
+    "",
+    "Cask Strength",
+    "Single Barrel",
+    "Small Batch",
+    "Sherry Cask",
+    "Port Finish",
+    "Distillery Exclusive",
+    "Batch {batch}",
+    "Uigeadail",
+    "Rare Breed",
+    "Barrel Proof",
+    "Store Pick",
+    "Single Cask #{cask}",
+]
+STYLES = ["Islay", "Speyside", "Highland", "Campbeltown", "Bourbon", "Rye", "Irish", "Japanese", "World"]
+
+
+def whisky_names(rng, count):
+    """count distinct whisky names built from distillery, expression and an age or vintage."""
+    names = []
+    seen = set()
+    while len(names) < count:
+        expression = rng.choice(EXPRESSIONS).format(batch=rng.randint(1, 30), cask=rng.randint(100, 9999))
+        age = rng.choice(["", "", f"{rng.randint(8, 30)}", f"{rng.randint(1990, 2023)}"])
+        name = " ".join(part for part in (rng.choice(DISTILLERIES), age, expression) if part)
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def zipf_picker(rng, items, exponent=1.1):
+    weights = list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, len(items) + 1)))
+    return lambda: rng.choices(items, cum_weights=weights)[0]
+
+
+def random_date(rng):
+    # Days up to 31 in every month, since the sheet has impossible dates like 2/30 as well
+    m, d, y = rng.randint(1, 12), rng.randint(1, 31), rng.randint(2010, 2024)
+    divider = rng.choice("/-.")
+    year = str(y) if rng.random() < 0.5 else str(y % 100).zfill(2)
+    month = str(m).zfill(2) if rng.random() < 0.5 else str(m)
+    parts = [month, str(d), year]
+    if rng.random() < 0.1:
+        # Doubled divider somewhere
+        parts[rng.randint(0, 1)] += divider
+    date = divider.join(parts)
+    if rng.random() < 0.02:
+        date = rng.choice(["", "n/a", "unknown", "13/45/15", "1999-01-01", "5/5", "1/2-15", "1999/1/1"])
+    return date
+
+
+def random_rating(rng):
+    roll = rng.random()
+    if roll < 0.05:
+        return rng.choice(["", "n/a", "NR", "85/100", "90+"])
+    return str(min(100, max(40, int(rng.gauss(84, 6)))))
+
+
+def random_price(rng):
+    roll = rng.random()
+    if roll < 0.3:
+        return ""
+    if roll < 0.4:
+        return rng.choice(["sample", "gift", "n/a", "£45", "€60"])
+    return f"${rng.randint(20, 400)}"
+
+
+def write_sheet(fout, rows, seed=1234):
+    rng = random.Random(seed)
+    # Roughly how the real sheet grows: about one whisky per five reviews, a long tail of occasional reviewers
+    pick_whisky = zipf_picker(rng, whisky_names(rng, max(1, rows // 5)), exponent=0.9)
+    pick_user = zipf_picker(rng, [f"user_{idx}" for idx in range(max(1, rows // 25))])
+    writer = csv.writer(fout)
+    writer.writerow(HEADER)
+    for idx in range(rows):
+        writer.writerow(
+            [
+                "",
+                pick_whisky(),
+                pick_user(),
+                f"https://www.reddit.com/r/{rng.choice(['scotch', 'bourbon', 'worldwhisky'])}/comments/{idx:x}/",
+                random_rating(rng),
+                rng.choice(STYLES),
+                random_price(rng),
+                random_date(rng),
+            ]
+        )
+
+
+def generate(rows, seed=1234):
+    buff = io.StringIO()
+    write_sheet(buff, rows, seed)
+    return buff.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic review spreadsheet CSV")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("-s", "--seed", type=int, default=1234)
+    parser.add_argument("-o", "--output", help="CSV path (default: stdout)")
+    args = parser.parse_args()
+    if args.output:
+        with open(args.output, "w", newline="") as fout:
+            write_sheet(fout, args.rows, args.seed)
+    else:
+        write_sheet(sys.stdout, args.rows, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import numpy as np
+from collections import namedtuple
+from elmerbot.store import NO_RATING
+
+
+DISTRIBUTION_BUCKETS = 10
+
+WhiskyStats = namedtuple(
+    "WhiskyStats",
+    ["id", "name", "count", "mean", "stddev", "median", "p10", "p90", "zscore", "percentile", "distribution"],
+)
+
+
+class RatingsEngine(object):
+    """Vectorized rating statistics built once per snapshot from the ReviewStore columns. Ratings are grouped by
+    whisky, reviewer and month so every query is a slice or a single NumPy pass instead of a Python loop over reviews.
+
+    The masked columns are only needed while building; what is kept per process is one int16 copy of the rated
+    ratings (sorted within each whisky, for per-whisky percentiles), a histogram of all ratings and the per-group
+    aggregates. Global percentiles and ranks are answered from the histogram.
+
+    Like the rest of the bot, only truthy ratings count: unrated and zero scores are ignored.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        ratings = np.frombuffer(store.ratings, dtype=np.int16)
+        mask = (ratings != NO_RATING) & (ratings != 0)
+        rated = ratings[mask]
+        whiskies = np.frombuffer(store.whiskies, dtype=np.uint32)[mask]
+        reviewers = np.frombuffer(store.user_idx, dtype=np.uint32)[mask]
+        months = np.frombuffer(store.dates, dtype=np.uint32)[mask] // 100
+        self.months, month_idx = np.unique(months, return_inverse=True)
+
+        self.count = len(rated)
+        self.mean = float(rated.mean(dtype=np.float64)) if self.count else 0.0
+        self.stddev = float(rated.std(dtype=np.float64, ddof=1)) if self.count > 1 else 0.0
+        # Sorted ratings as counts per value: the value at rank k is the first one whose cumulative count exceeds k
+        low = int(rated.min()) if self.count else 0
+        self._values = np.arange(low, int(rated.max()) + 1 if self.count else 1)
+        self._cumulative = np.cumsum(np.bincount(rated.astype(np.intp) - low, minlength=len(self._values)))
+
+        self.whisky_counts, self.whisky_means = self._group(whiskies, rated, len(store.names))
+        self.reviewer_counts, self.reviewer_means = self._group(reviewers, rated, len(store.usernames))
+        self.month_counts, self.month_means = self._group(month_idx, rated, len(self.months))
+
+        # Ratings sorted within each whisky so per-whisky percentiles are just slices
+        self._grouped_ratings = rated[np.lexsort((rated, whiskies))]
+        self._group_starts = np.concatenate(([0], np.cumsum(self.whisky_counts)))
+
+    @staticmethod
+    def _group(keys, ratings, size):
+        counts = np.bincount(keys, minlength=size)
+        sums = np.bincount(keys, weights=ratings, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return counts, means
+
+    def _ranked(self, ranks):
+        """Values at the given ranks (0 is the lowest) of all ratings in sorted order."""
+        return self._values[np.searchsorted(self._cumulative, ranks, side="right")]
+
+    def percentiles(self, qs, pos=None):
+        """Rating percentiles, globally or for the whisky at store position pos."""
+        if pos is not None:
+            ratings = self.whisky_ratings(pos)
+            if not len(ratings):
+                return [None for _ in qs]
+            return np.percentile(ratings, qs).tolist()
+        if not self.count:
+            return [None for _ in qs]
+        # Same linear interpolation between neighbouring ranks as np.percentile
+        positions = np.asarray(qs, dtype=np.float64) / 100 * (self.count - 1)
+        below = np.floor(positions).astype(np.intp)
+        lower = self._ranked(below)
+        upper = self._ranked(np.minimum(below + 1, self.count - 1))
+        return (lower + (upper - lower) * (positions - below)).tolist()
+
+    def percentile_rank(self, value):
+        """Percentage of all ratings strictly below value."""
+        if not self.count:
+            return 0.0
+        idx = int(np.searchsorted(self._values, value, side="left"))
+        below = int(self._cumulative[idx - 1]) if idx else 0
+        return 100.0 * below / self.count
+
+    def zscores(self, values):
+        if not self.stddev:
+            return np.zeros(len(values))
+        return (np.asarray(values, dtype=np.float64) - self.mean) / self.stddev
+
+    def distribution(self, ratings=None):
+        """Counts of ratings per band of ten points: 0-9, 10-19, ... 90-100."""
+        ratings = self._grouped_ratings if ratings is None else ratings
+        buckets = np.clip(ratings // 10, 0, DISTRIBUTION_BUCKETS - 1).astype(np.intp)
+        return np.bincount(buckets, minlength=DISTRIBUTION_BUCKETS).tolist()
+
+    def whisky_ratings(self, pos):
+        return self._grouped_ratings[self._group_starts[pos] : self._group_starts[pos + 1]]
+
+    def top(self, limit=10, min_reviews=5):
+        """Store positions of the best whiskies by mean rating among those with at least min_reviews ratings, with
+        ties going to the whisky with more ratings.
+        """
+        eligible = np.flatnonzero(self.whisky_counts >= min_reviews)
+        order = np.lexsort((-self.whisky_counts[eligible], -self.whisky_means[eligible]))
+        return eligible[order[:limit]].tolist()
+
+    def whisky_stats(self, pos):
+        ratings = self.whisky_ratings(pos)
+        if not len(ratings):
+            return None
+        mean = float(ratings.mean())
+        median, p10, p90 = np.percentile(ratings, [50, 10, 90]).tolist()
+        return WhiskyStats(
+            pos + 1,
+            self._store.names[pos],
+            len(ratings),
+            mean,
+            float(ratings.std(ddof=1)) if len(ratings) > 1 else 0.0,
+            median,
+            p10,
+            p90,
+            float(self.zscores([mean])[0]),
+            self.percentile_rank(mean),
+            self.distribution(ratings),
+        )
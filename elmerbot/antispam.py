@@ -1,24 +1,126 @@
+import asyncio
 import logging
+import os
 import re
+import time
 
 
-invite_pattern = re.compile(r"discord\.gg/\w{3}")
-tag_pattern = re.compile(r"add.*tag.*\d{4}")
-twitch_pattern = re.compile(r"twitch\.tv")
-twitter_pattern = re.compile(r"twitter\.com")
-debugging_pattern = re.compile(r"elmerbot_spam_name_debugging")
-name_patterns = [invite_pattern, tag_pattern, twitch_pattern, twitter_pattern, debugging_pattern]
+# Used when no pattern file is configured
+default_patterns = [
+    r"discord\.gg/\w{3}",
+    r"add.*tag.*\d{4}",
+    r"twitch\.tv",
+    r"twitter\.com",
+    r"elmerbot_spam_name_debugging",
+]
 
 
-def check_name(name):
-    """This aims to catch a few common types of spammers.
-    Right now it includes:
+class SpamMatcher(object):
+    """This aims to catch a few common types of spammers, for example:
     @discord.gg/abcdefg
     @pls add blahblah (tag) 1234
+
+    All patterns are compiled into one regex so a name is checked in a single pass. Patterns can come from a file
+    (one regex per line, # for comments) which is reloaded when it changes, at most every reload_interval seconds.
     """
-    logger = logging.getLogger("elmerbot.namecheck")
-    for pattern in name_patterns:
-        if pattern.search(name):
-            logger.warn(f'Found spammer with name "{name}" using pattern "{pattern.pattern}"')
+
+    def __init__(self, path=None, reload_interval=30):
+        self._path = path
+        self._reload_interval = reload_interval
+        self._last_checked = -reload_interval
+        self._mtime = None
+        self._logger = logging.getLogger("elmerbot.namecheck")
+        self.patterns = []
+        self._combined = None
+        self._compile(default_patterns)
+        self.maybe_reload()
+
+    def _compile(self, patterns):
+        # Compile each pattern alone first so a bad line can't silently change the meaning of its neighbours
+        for pattern in patterns:
+            re.compile(pattern)
+        combined = re.compile("|".join(f"(?P<p{idx}>{pattern})" for idx, pattern in enumerate(patterns)))
+        self.patterns = list(patterns)
+        self._combined = combined
+
+    def maybe_reload(self):
+        if not self._path:
+            return
+        now = time.monotonic()
+        if now - self._last_checked < self._reload_interval:
+            return
+        self._last_checked = now
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            with open(self._path) as fin:
+                patterns = [line.strip() for line in fin if line.strip() and not line.lstrip().startswith("#")]
+            self._compile(patterns)
+        except (OSError, re.error) as e:
+            # Keep using the last good set of patterns
+            self._logger.error(f"Could not load spam patterns from {self._path}: {e}")
+            return
+        self._logger.info(f"Loaded {len(self.patterns)} spam patterns from {self._path}")
+
+    def match(self, name):
+        """Return the pattern that matched name, or None."""
+        self.maybe_reload()
+        found = self._combined.search(name) if self.patterns else None
+        if found:
+            return self.patterns[int(found.lastgroup[1:])]
+
+    def check_name(self, name):
+        pattern = self.match(name)
+        if pattern is not None:
+            self._logger.warning(f'Found spammer with name "{name}" using pattern "{pattern}"')
             return True
-    return False
+        return False
+
+    async def sweep(self, members, ban=None, chunk_size=500, ban_delay=1.0):
+        """Check existing members in chunks, yielding to the event loop between chunks. Matches are banned one at a
+        time with ban_delay seconds between them to stay clear of rate limits. Without a ban coroutine this is a dry
+        run. Returns a report of what was (or would have been) banned.
+        """
+        members = list(members)
+        matched = []
+        for idx in range(0, len(members), chunk_size):
+            for member in members[idx : idx + chunk_size]:
+                pattern = self.match(member.name)
+                if pattern is not None:
+                    matched.append((member, pattern))
+            await asyncio.sleep(0)
+
+        report = {"checked": len(members), "matched": [], "banned": 0, "failed": 0, "dry_run": ban is None}
+        for member, pattern in matched:
+            report["matched"].append({"id": member.id, "name": member.name, "pattern": pattern})
+            if ban is None:
+                continue
+            try:
+                await ban(member)
+                report["banned"] += 1
+            except Exception as e:
+                self._logger.error(f"Failed to ban {member.name} ({member.id}): {e}")
+                report["failed"] += 1
+            await asyncio.sleep(ban_delay)
+        self._logger.info(
+            "Sweep checked {checked} members, matched {}, banned {banned}, failed {failed}{}".format(
+                len(report["matched"]), " (dry run)" if report["dry_run"] else "", **report
+            )
+        )
+        return report
+
+
+matcher = SpamMatcher()
+
+
+def configure(path, reload_interval=30):
+    """Point the shared matcher at a pattern file."""
+    global matcher
+    matcher = SpamMatcher(path, reload_interval)
+    return matcher
+
+
+def check_name(name):
+    return matcher.check_name(name)
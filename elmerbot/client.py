@@ -1,11 +1,20 @@
 import argparse
+import asyncio
 import discord
 import logging
+import time
 import yaml
+from elmerbot import antispam
 from elmerbot.antispam import check_name
+from elmerbot import commands, parsers, rates
 from elmerbot.commands import ElmerCommand
+from elmerbot.executor import WorkPool
+from elmerbot.index import MAX_CANDIDATES
+from elmerbot.joins import JoinScheduler
 from elmerbot.logs import configure_logger
+from elmerbot.metrics import metrics, start as start_metrics
 from elmerbot.parsers import ElmerParser
+from elmerbot.plugins import startup
 from elmerbot.reviews import ReviewData
 
 
@@ -13,101 +22,232 @@ class ElmerBotClient(discord.Client):
     greeting = "Slàinte Mhath"
     prefix = "!"
 
-    def __init__(self, settings):
+    def __init__(self, settings, shard_id=None, shard_count=None, follower=False, profile_startup=False):
         self._settings = settings
-        self.data = ReviewData()
+        self._profile_startup = profile_startup
+        self.pool = WorkPool.from_settings(settings.get("pool"))
+        # Followers read the snapshot file kept fresh by a separate loader process instead of fetching the sheet
+        self.data = ReviewData(
+            pool=self.pool, follower=follower, max_candidates=settings.get("search_candidates", MAX_CANDIDATES)
+        )
         self._greeting_channel = None
         self._newuser_role = None
+        self.joins = JoinScheduler(self, settings.get("joins"))
         self._logger = logging.getLogger("elmerbot.client")
-        for command_obj in ElmerCommand.registry:
-            self._logger.info(f"Registered command module: {type(command_obj).__name__}")
-        for parser_obj in ElmerParser.registry:
-            self._logger.info(f"Registered parser module: {type(parser_obj).__name__}")
-        super(ElmerBotClient, self).__init__(intents=discord.Intents.all())
+        if "spam_patterns_file" in settings:
+            antispam.configure(settings["spam_patterns_file"])
+        if "currency" in settings:
+            rates.configure(settings["currency"])
+        self._metrics_tasks = None
+        self._swept = False
+        self._register_gauges()
+        # Plugins are only imported on first use, so this just lists what is declared
+        for plugin in commands.plugins.enabled():
+            self._logger.info(f"Registered command module: {plugin.target}")
+        for plugin in parsers.plugins.enabled():
+            self._logger.info(f"Registered parser module: {plugin.target}")
+        super(ElmerBotClient, self).__init__(
+            intents=discord.Intents.all(), shard_id=shard_id, shard_count=shard_count
+        )
 
     def run(self):
         super(ElmerBotClient, self).run(self._settings.get("token", ""))
 
+    async def setup_hook(self):
+        # Runs before the gateway connects, so joins and member updates that arrive ahead of READY (while guilds are
+        # still chunking) already have workers to handle them
+        self.joins.start()
+
     async def on_ready(self):
         self._logger.info("Logged in as {} {}".format(self.user.name, self.user.id))
+        if self._profile_startup:
+            # on_ready fires again after reconnects, only the first one counts
+            self._profile_startup = False
+            startup.mark("ready")
+            # Load everything now, purely to measure what each plugin costs once it is first used
+            commands.plugins.load_all()
+            parsers.plugins.load_all()
+            startup.log_report()
+        if self._metrics_tasks is None:
+            self._metrics_tasks = start_metrics(self._settings.get("metrics", {}))
+        # Warm up review data in the background so the first command doesn't have to wait for it
+        self.data.refresh()
         if "greeting_room_id" in self._settings:
+            # When sharded, only the shard that owns the greeting guild can see the channel
             self._greeting_channel = self.get_channel(self._settings["greeting_room_id"])
             self._logger.info(f"Greeting channel: {self._greeting_channel}")
-            if "newuser_role_id" in self._settings:
+            if self._greeting_channel and "newuser_role_id" in self._settings:
                 for role in self._greeting_channel.guild.roles:
                     if role.id == self._settings["newuser_role_id"]:
                         self._newuser_role = role
                         self._logger.info(f"New user role: {role.name} (#{role.id})")
                 if self._newuser_role is None:
                     self._logger.warning("New user role not found")
+        if self._settings.get("sweep_on_ready") and not self._swept:
+            # Like the startup profile, only after the first on_ready and not again after every reconnect
+            self._swept = True
+            asyncio.ensure_future(self.sweep_members(dry_run=self._settings.get("sweep_dry_run", True)))
 
-    async def on_member_join(self, member):
+    def _ban_message(self):
         if "appeal_server_id" in self._settings:
-            msg = (
+            return (
                 "You are being banned because your name matched a spam filter. If this "
                 "was done in error and you would like to request to be unbanned, please "
                 f"join our ban appeal server at https://discord.gg/{self._settings['appeal_server_id']}"
             )
-        else:
-            msg = (
-                "You are being banned because your name matched a spam filter. If this was done in error, please "
-                "rejoin from another IP with a username not containing any promotional information and speak with a "
-                "moderator."
-            )
-        if check_name(member.name):
-            await member.send(msg)
-            await member.ban()
-        if self._greeting_channel:
-            await self._greeting_channel.send("{}, {}!".format(self.greeting, member.mention))
-        if self._newuser_role:
-            await member.add_roles(self._newuser_role)
+        return (
+            "You are being banned because your name matched a spam filter. If this was done in error, please "
+            "rejoin from another IP with a username not containing any promotional information and speak with a "
+            "moderator."
+        )
+
+    async def ban_spammer(self, member):
+        try:
+            await member.send(self._ban_message())
+        except discord.HTTPException:
+            # Members can block DMs, that shouldn't stop the ban
+            self._logger.warning(f"Could not DM {member.name} before banning")
+        await member.ban()
+
+    async def sweep_members(self, guild=None, dry_run=True):
+        """Check every existing member against the spam patterns, e.g. after new patterns were added."""
+        members = guild.members if guild else list(self.get_all_members())
+        # Bans go through the join scheduler's paced queue, which also skips members already queued for a ban
+        return await antispam.matcher.sweep(members, ban=None if dry_run else self._queue_ban, ban_delay=0)
+
+    async def _queue_ban(self, member):
+        self.joins.ban(member)
+
+    @property
+    def greeting_channel(self):
+        return self._greeting_channel
+
+    @property
+    def newuser_role(self):
+        return self._newuser_role
+
+    async def on_member_join(self, member):
+        # Greetings, roles and bans are queued so a flood of joins can't flood the API from here
+        self.joins.member_joined(member, spammer=check_name(member.name))
 
     async def on_member_update(self, before, after):
         if check_name(after.name):
-            await after.send(msg)
-            await after.ban()
+            self.joins.ban(after)
+
+    def _record_stage(self, stage, started):
+        elapsed = time.perf_counter() - started
+        histogram = metrics.histogram(
+            "elmerbot_dispatch_seconds", "Time from message receipt to each dispatch stage", stage=stage
+        )
+        histogram.observe(elapsed)
+        self._logger.debug(f"Dispatch stage {stage} took {elapsed * 1000:.3f}ms")
+
+    def _register_gauges(self):
+        metrics.gauge(
+            "elmerbot_search_cache",
+            "Search result cache counters",
+            lambda: {(("stat", key),): value for key, value in self.data.search_cache_info().items()},
+        )
+        metrics.gauge(
+            "elmerbot_render_cache",
+            "Rendered response cache counters",
+            lambda: {(("stat", key),): value for key, value in self.data.render_cache.info().items()},
+        )
+        metrics.gauge("elmerbot_review_data_version", "Version of the published review data", lambda: self.data.version)
+        metrics.gauge("elmerbot_pool_pending", "Tasks waiting or running in the work pool", lambda: self.pool.pending)
+        metrics.gauge(
+            "elmerbot_pool_rejected", "Tasks rejected because the work pool was full", lambda: self.pool.rejected
+        )
+        metrics.gauge("elmerbot_join_queue_depth", "Queued join actions", lambda: self.joins.actions.depth)
+        metrics.gauge(
+            "elmerbot_join_queue_last_drain_seconds",
+            "How long the last join action backlog took to drain",
+            lambda: self.joins.actions.last_drain_time,
+        )
+        metrics.gauge(
+            "elmerbot_join_scheduler",
+            "Join handling state: action queue counters, raid mode, pending greetings and bans",
+            lambda: {(("stat", key),): value for key, value in self.joins.stats().items()},
+        )
 
     async def on_message(self, message):
         if not message.guild or not message.channel:
             return
 
         # Prevent bot answering itself
-        myself = [m for m in message.guild.members if m.id == self.user.id][0]
-        if message.author == myself:
+        if message.author.id == self.user.id:
             return
 
-        # Check all parsers
-        for parser in ElmerParser.registry:
-            if parser.enabled and parser.check(message.content):
-                await parser.handle(self, message)
-
-        # Validate against prefix
-        if not message.content.lower().startswith(self.prefix):
+        started = time.perf_counter()
+        content = message.content
+        if not content.startswith(self.prefix):
+            # Not a command, so only parsers can be interested. One combined search rejects almost every message.
+            combined = ElmerParser.combined_pattern()
+            if combined is None or not combined.search(content):
+                self._record_stage("reject", started)
+                return
+            for parser in ElmerParser.enabled_parsers():
+                if parser.check(content):
+                    self._record_stage("parse_match", started)
+                    with metrics.timed("elmerbot_parser_seconds", "parser handling", parser=parser.name):
+                        await parser.handle(self, message)
+            self._record_stage("parse", started)
             return
 
         # Just for a while to ease the transition
-        if message.content.startswith("!elmer"):
+        if content.startswith("!elmer"):
             await message.channel.send("I've been tweaked to use **!** instead of **!elmer** now.")
             return
 
-        # Parse out command and check against all commands
-        contents = message.content[len(self.prefix) :]
-        command, _, args = contents.strip().partition(" ")
+        # Parse out command and route it. Split on any whitespace so multi-line commands like !lookup work.
+        command, *args = content[len(self.prefix) :].strip().split(None, 1) or [""]
+        args = args[0] if args else ""
         handler = ElmerCommand.find(command)
+        self._record_stage("route", started)
         if handler:
-            await handler.handle(self, message, args)
+            with metrics.timed("elmerbot_command_seconds", "command handling", command=handler.command):
+                await handler.handle(self, message, args)
+            self._record_stage("command", started)
+            self._logger.info(
+                f"Handled {handler.command} command",
+                extra={
+                    "event": "command",
+                    "guild": message.guild.id,
+                    "command": handler.command,
+                    "latency": round(time.perf_counter() - started, 6),
+                },
+            )
 
 
 def main():
     parser = argparse.ArgumentParser(description="Starts elmerbot client")
     parser.add_argument("-e", "--env", help="production or development (Default: development)", default="development")
     parser.add_argument("-s", "--settings", help="YAML file with settings", default="settings.yaml")
+    parser.add_argument(
+        "--shards", help="Run N shard processes sharing one copy of the review data, or 'auto' to ask Discord"
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Log import and time to ready for the core modules and every enabled plugin once connected",
+    )
     args = parser.parse_args()
+    startup.mark("imports")
     settings = yaml.load(open(args.settings), Loader=yaml.SafeLoader)
-    configure_logger("elmerbot", logging.INFO)
+    configure_logger("elmerbot", logging.INFO, **settings[args.env].get("logging", {}))
     logger = logging.getLogger("elmerbot.main")
+    shards = args.shards or settings[args.env].get("shards")
+    if shards:
+        # Imported here since shards imports this module
+        from elmerbot.shards import run_sharded
+
+        logger.info(f"Starting sharded bot ({shards})...")
+        run_sharded(settings[args.env], shards)
+        logger.info("Exiting...")
+        return
     logger.info("Starting bot...")
-    client = ElmerBotClient(settings[args.env])
+    client = ElmerBotClient(settings[args.env], profile_startup=args.profile_startup)
+    startup.mark("client")
     client.run()
     logger.info("Exiting...")
 
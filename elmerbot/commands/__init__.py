@@ -1,12 +1,15 @@
+import discord
 import logging
-from elmerbot import RegisteredClass
+from elmerbot.plugins import Plugin, PluginSet
 
 
-class ElmerCommand(object, metaclass=RegisteredClass):
+class ElmerCommand(object):
     """Provides a base class for commands to inherit. Contains the following class variables:
 
     command - The command typed in chat to trigger the execution of this object.
     description - The text sent from the help command.
+
+    Commands are declared in plugins below (with their aliases) and only imported when first used.
     """
 
     command = None
@@ -18,13 +21,31 @@ class ElmerCommand(object, metaclass=RegisteredClass):
     async def handle(self, message, args):
         raise NotImplementedError
 
+    def cached_embed(self, client, key, render):
+        """Return the embed for key, calling render() to build it only if it isn't in the render cache. The cache
+        key includes the data version, so nothing rendered from older review data is ever served.
+        """
+        key = (self.command, key, client.data.version)
+        payload = client.data.render_cache.get(key)
+        if payload is None:
+            payload = render().to_dict()
+            client.data.render_cache.put(key, payload)
+        # A fresh Embed each time, so nothing downstream can modify the cached payload
+        return discord.Embed.from_dict(payload)
+
     @classmethod
     def find(cls, pattern):
-        for command in cls.registry:
-            if command.command == pattern:
-                return command
-
-
-# Load subclasses and register them
-from elmerbot.commands.help import *
-from elmerbot.commands.search import *
+        return plugins.find(pattern)
+
+
+plugins = PluginSet(
+    [
+        Plugin("help", "elmerbot.commands.help:HelpCommand", aliases=("commands",)),
+        Plugin("search", "elmerbot.commands.search:SearchCommand"),
+        Plugin("info", "elmerbot.commands.search:InfoCommand"),
+        Plugin("lookup", "elmerbot.commands.search:LookupCommand"),
+        Plugin("top", "elmerbot.commands.stats:TopCommand"),
+        Plugin("stats", "elmerbot.commands.stats:StatsCommand"),
+        Plugin("sweep", "elmerbot.commands.moderation:SweepCommand"),
+    ]
+)
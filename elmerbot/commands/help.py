@@ -1,5 +1,5 @@
 import discord
-from elmerbot.commands import ElmerCommand
+from elmerbot.commands import ElmerCommand, plugins
 
 
 __all__ = ["HelpCommand"]
@@ -11,15 +11,18 @@ class HelpCommand(ElmerCommand):
 
     async def handle(self, client, message, args):
         self._logger.info("Got help command!")
-        # First add high level usage info
+        em = self.cached_embed(client, client.prefix, lambda: self.render(client))
+        await message.author.send(embed=em)
+        await message.delete()
 
+    def render(self, client):
+        # First add high level usage info
         output = ["**Usage**: `{} <command> <arguments>`\n".format(client.prefix)]
         # Now dynamically generate command help
         output.append("**Commands**\n")
-        for command in ElmerCommand.registry:
-            output.append("**{}**\n{}\n".format(command.command, command.description))
-        # Combine, send, and clean up the help command message
+        for plugin in plugins.enabled():
+            name = " / ".join((plugin.name,) + plugin.aliases)
+            output.append("**{}**\n{}\n".format(name, plugin.load().description))
+        # Combine into one message
         help_msg = "\n".join(output)
-        em = discord.Embed(title="ElmerBot Help", description=help_msg, colour=0x00DD00)
-        await message.author.send(embed=em)
-        await message.delete()
+        return discord.Embed(title="ElmerBot Help", description=help_msg, colour=0x00DD00)
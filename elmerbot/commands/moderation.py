@@ -0,0 +1,40 @@
+import discord
+from elmerbot.commands import ElmerCommand
+
+
+__all__ = ["SweepCommand"]
+
+
+class SweepCommand(ElmerCommand):
+    command = "sweep"
+    description = (
+        "Moderators only. Check every member of this server against the spam name filters and report matches. "
+        "Add `ban` to ban them as well.\n"
+        "Examples: `!sweep` or `!sweep ban`"
+    )
+    max_listed = 20
+
+    async def handle(self, client, message, args):
+        self._logger.info("Got sweep command")
+        if not message.author.guild_permissions.ban_members:
+            await message.channel.send("Only moderators who can ban members can run a sweep.")
+            return
+        dry_run = args.strip().lower() != "ban"
+        await message.channel.send(
+            "Sweeping {} members{}...".format(message.guild.member_count, " (dry run)" if dry_run else "")
+        )
+        report = await client.sweep_members(message.guild, dry_run=dry_run)
+
+        output = ["Checked {} members and matched {}.".format(report["checked"], len(report["matched"]))]
+        if not dry_run:
+            output.append("Queued {} bans, failed {}.".format(report["banned"], report["failed"]))
+        for match in report["matched"][: self.max_listed]:
+            output.append("`{}` ({}) matched `{}`".format(match["name"], match["id"], match["pattern"]))
+        if len(report["matched"]) > self.max_listed:
+            output.append("...and {} more.".format(len(report["matched"]) - self.max_listed))
+        em = discord.Embed(
+            title="Spam sweep report" + (" (dry run)" if dry_run else ""),
+            description="\n".join(output),
+            colour=0x00DD00 if not report["matched"] else 0xDD0000,
+        )
+        await message.channel.send(embed=em)
@@ -1,9 +1,13 @@
 import discord
 import string
 from elmerbot.commands import ElmerCommand
+from elmerbot.executor import PoolBusy
 
 
-__all__ = ["SearchCommand", "InfoCommand"]
+__all__ = ["SearchCommand", "InfoCommand", "LookupCommand"]
+
+BUSY_MESSAGE = "I'm a bit busy right now, please try again in a moment."
+UNAVAILABLE_MESSAGE = "Review data isn't available right now, try again in a moment."
 
 
 class SearchCommand(ElmerCommand):
@@ -16,8 +20,12 @@ class SearchCommand(ElmerCommand):
 
     async def handle(self, client, message, args):
         self._logger.info("Got search command")
-        if client.data.stale:
+        if not client.data.loaded:
             await message.channel.send("One moment, reloading review data...")
+        await client.data.ensure_loaded()
+        if not client.data.loaded:
+            await message.channel.send(UNAVAILABLE_MESSAGE)
+            return
         await message.channel.trigger_typing()
         first, _, rest = args.partition(" ")
         pattern = args
@@ -28,7 +36,11 @@ class SearchCommand(ElmerCommand):
         # Whitelist characters to eliminate Markdown injection
         whitelist = string.ascii_letters + string.digits + "'()-., "
         pattern = "".join([c for c in pattern if c in whitelist])
-        results = client.data.search(pattern, choices)
+        try:
+            results = await client.data.asearch(pattern, choices)
+        except PoolBusy:
+            await message.channel.send(BUSY_MESSAGE)
+            return
 
         # Stop now if there's nothing to show
         if not results:
@@ -67,8 +79,12 @@ class InfoCommand(ElmerCommand):
     async def handle(self, client, message, args):
         self._logger.info("Got info command")
         pending_msg = None
-        if client.data.stale:
+        if not client.data.loaded:
             pending_msg = await message.channel.send("One moment, reloading review data...")
+        await client.data.ensure_loaded()
+        if not client.data.loaded:
+            await message.channel.send(UNAVAILABLE_MESSAGE)
+            return
         await message.channel.trigger_typing()
         if args.isnumeric():
             whisky_id = int(args)
@@ -76,7 +92,11 @@ class InfoCommand(ElmerCommand):
             # Whitelist characters to eliminate Markdown injection
             whitelist = string.ascii_letters + string.digits + "'()-., "
             pattern = "".join([c for c in args if c in whitelist])
-            result = client.data.search(pattern, 1)
+            try:
+                result = await client.data.asearch(pattern, 1)
+            except PoolBusy:
+                await message.channel.send(BUSY_MESSAGE)
+                return
             if not result:
                 em = discord.Embed(
                     title='Could not find "{}"'.format(pattern),
@@ -86,18 +106,30 @@ class InfoCommand(ElmerCommand):
                 await message.channel.send(embed=em)
                 return
             whisky_id = result[0][1]
-        data = client.data.find(whisky_id)
         if pending_msg:
             await pending_msg.delete()
+        # Answers only change when the review data reloads, so popular bottles are rendered once per version
+        em = self.cached_embed(client, whisky_id, lambda: self.render(client, whisky_id))
+        await message.channel.send(embed=em)
+
+    def render(self, client, whisky_id):
+        summary = client.data.summary(whisky_id)
+        if summary is None:
+            return discord.Embed(
+                title="No whisky with id #{}".format(whisky_id),
+                description="Try using **!search** first.",
+                colour=0xDD0000,
+            )
         output = []
 
-        # Generate stats
-        ratings = [row["rating"] for row in data if row["rating"]]
-        if ratings:
-            avg_rating = round(sum(ratings) / float(len(ratings)), 2)
+        # Stats are precomputed when the review data is loaded
+        if summary.rated_count:
+            avg_rating = round(summary.mean, 2)
             delta = round(avg_rating - client.data.avg, 2)
             delta = "+" + str(delta) if delta >= 0.0 else str(delta)
-            output.append("**Average rating:** {} based on {} reviews with scores.".format(avg_rating, len(ratings)))
+            output.append(
+                "**Average rating:** {} based on {} reviews with scores.".format(avg_rating, summary.rated_count)
+            )
             output.append(
                 "It is {} from the global average \
                     of {} with standard deviation {}".format(
@@ -113,5 +145,47 @@ class InfoCommand(ElmerCommand):
                 )
         else:
             output.append("**Average rating:** No reviews with scores.")
-        em = discord.Embed(title="{}".format(data[0]["name"]), description="\n".join(output), colour=0x00DD00)
+        return discord.Embed(title="{}".format(summary.name), description="\n".join(output), colour=0x00DD00)
+
+
+class LookupCommand(ElmerCommand):
+    command = "lookup"
+    description = (
+        "Look up many whiskies at once, one name per line, and show the best match for each.\n"
+        "Example:\n`!lookup stagg 2014\nlagavulin 16\nblantons`"
+    )
+    max_lines = 25
+
+    async def handle(self, client, message, args):
+        self._logger.info("Got lookup command")
+        if not client.data.loaded:
+            await message.channel.send("One moment, reloading review data...")
+        await client.data.ensure_loaded()
+        if not client.data.loaded:
+            await message.channel.send(UNAVAILABLE_MESSAGE)
+            return
+        await message.channel.trigger_typing()
+        # Whitelist characters to eliminate Markdown injection
+        whitelist = string.ascii_letters + string.digits + "'()-., "
+        patterns = ["".join([c for c in line if c in whitelist]).strip() for line in args.splitlines()]
+        patterns = [pattern for pattern in patterns if pattern][: self.max_lines]
+        if not patterns:
+            await message.channel.send("Put one whisky name per line after **!lookup**.")
+            return
+        try:
+            results = await client.data.search_many(patterns)
+        except PoolBusy:
+            await message.channel.send(BUSY_MESSAGE)
+            return
+
+        output = []
+        for pattern, result in zip(patterns, results):
+            if result:
+                token, whisky_id, conf = result[0]
+                output.append("{} → **{}** [#{}] ({}%)".format(pattern, token, whisky_id, conf))
+            else:
+                output.append("{} → no match".format(pattern))
+        em = discord.Embed(
+            title="Lookup results for {} names".format(len(patterns)), description="\n".join(output), colour=0x00DD00
+        )
         await message.channel.send(embed=em)
@@ -0,0 +1,110 @@
+import discord
+from elmerbot.commands import ElmerCommand
+
+
+__all__ = ["TopCommand", "StatsCommand"]
+
+
+def distribution_lines(counts):
+    # Skip the empty low bands so the chart stays short
+    first = next((idx for idx, count in enumerate(counts) if count), len(counts))
+    peak = max(counts) or 1
+    lines = []
+    for idx in range(first, len(counts)):
+        label = "{}-{}".format(idx * 10, idx * 10 + 9 if idx < len(counts) - 1 else 100)
+        lines.append("`{:>6}` {} {}".format(label, "█" * round(12 * counts[idx] / peak), counts[idx]))
+    return lines
+
+
+class TopCommand(ElmerCommand):
+    command = "top"
+    description = (
+        "Show the highest rated whiskies. Optionally give how many to show and the minimum number of rated reviews.\n"
+        "Examples: `!top` or `!top 10 25`"
+    )
+
+    async def handle(self, client, message, args):
+        self._logger.info("Got top command")
+        await client.data.ensure_loaded()
+        analytics = client.data.analytics
+        if analytics is None:
+            await message.channel.send("Review data isn't available right now, try again in a moment.")
+            return
+        numbers = [int(arg) for arg in args.split() if arg.isnumeric()]
+        limit = min(numbers[0], 25) if numbers else 10
+        # At least one, unrated whiskies have no mean to rank
+        min_reviews = max(numbers[1], 1) if len(numbers) > 1 else 10
+
+        output = []
+        for rank, pos in enumerate(analytics.top(limit, min_reviews)):
+            output.append(
+                "{}. **{}** [#{}]: {:.2f} from {} ratings".format(
+                    rank + 1,
+                    client.data.whisky_name(pos + 1),
+                    pos + 1,
+                    analytics.whisky_means[pos],
+                    analytics.whisky_counts[pos],
+                )
+            )
+        if not output:
+            output.append("No whiskies have that many rated reviews.")
+        em = discord.Embed(
+            title="Top {} whiskies with at least {} rated reviews".format(limit, min_reviews),
+            description="\n".join(output),
+            colour=0x00DD00,
+        )
+        await message.channel.send(embed=em)
+
+
+class StatsCommand(ElmerCommand):
+    command = "stats"
+    description = (
+        "Show rating statistics for a whisky id from search results, or for all reviews if no id is given.\n"
+        "Examples: `!stats 1234` or `!stats`"
+    )
+
+    async def handle(self, client, message, args):
+        self._logger.info("Got stats command")
+        await client.data.ensure_loaded()
+        analytics = client.data.analytics
+        if analytics is None:
+            await message.channel.send("Review data isn't available right now, try again in a moment.")
+            return
+
+        args = args.strip()
+        if not args:
+            median, p10, p90 = analytics.percentiles([50, 10, 90])
+            output = [
+                "**Rated reviews:** {}".format(analytics.count),
+                "**Mean:** {:.2f}, **standard deviation:** {:.2f}".format(analytics.mean, analytics.stddev),
+                "**Median:** {:.0f}, **10th-90th percentile:** {:.0f}-{:.0f}".format(median, p10, p90),
+                "**Distribution:**",
+            ]
+            output += distribution_lines(analytics.distribution())
+            em = discord.Embed(title="All reviews", description="\n".join(output), colour=0x00DD00)
+            await message.channel.send(embed=em)
+            return
+
+        stats = None
+        if args.isnumeric() and client.data.whisky_name(int(args)):
+            stats = analytics.whisky_stats(int(args) - 1)
+        if stats is None:
+            em = discord.Embed(
+                title="No rated reviews for #{}".format(args),
+                description="Use **!search** to find a whisky id.",
+                colour=0xDD0000,
+            )
+            await message.channel.send(embed=em)
+            return
+        output = [
+            "**Rated reviews:** {}".format(stats.count),
+            "**Mean:** {:.2f}, **standard deviation:** {:.2f}".format(stats.mean, stats.stddev),
+            "**Median:** {:.0f}, **10th-90th percentile:** {:.0f}-{:.0f}".format(stats.median, stats.p10, stats.p90),
+            "**Z-score:** {:+.2f}, higher than {:.0f}% of all ratings".format(stats.zscore, stats.percentile),
+            "**Distribution:**",
+        ]
+        output += distribution_lines(stats.distribution)
+        em = discord.Embed(
+            title="{} [#{}]".format(stats.name, stats.id), description="\n".join(output), colour=0x00DD00
+        )
+        await message.channel.send(embed=em)
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import requests
+import time
+from elmerbot.metrics import metrics
+from requests.adapters import HTTPAdapter
+
+
+# Discord accepts at most this many embeds per webhook message, with at most this much text across all of them
+MAX_EMBEDS = 10
+MAX_CHARS = 6000
+# How long to wait for more embeds to share a webhook call with the first one
+LINGER = 1.0
+MAX_ATTEMPTS = 5
+BACKOFF = 2
+MAX_BACKOFF = 120
+
+
+def embed_size(embed):
+    """Characters that count towards Discord's per-message embed text limit."""
+    size = len(embed.get("title", "")) + len(embed.get("description", ""))
+    size += len(embed.get("footer", {}).get("text", "")) + len(embed.get("author", {}).get("name", ""))
+    for field in embed.get("fields", ()):
+        size += len(field.get("name", "")) + len(field.get("value", ""))
+    return size
+
+
+class WebhookDelivery(object):
+    """Delivers embeds to a Discord webhook from a queue. Embeds that arrive close together go out in one call (within
+    Discord's embed count and text limits), every call reuses the same pooled HTTP connections, 429s are retried after
+    Retry-After and other failures with exponential backoff. A batch rejected outright is retried one embed at a time.
+    Embeds that still fail are appended to the dead letter file as JSON lines, so nothing is lost silently.
+
+    Any URL works, so it can be pointed at a local stand-in server for testing.
+    """
+
+    def __init__(
+        self,
+        url,
+        dead_letter=None,
+        batch_size=MAX_EMBEDS,
+        linger=LINGER,
+        max_attempts=MAX_ATTEMPTS,
+        session=None,
+        executor=None,
+    ):
+        self._url = url
+        self._dead_letter = dead_letter
+        self._batch_size = min(batch_size, MAX_EMBEDS)
+        self._linger = linger
+        self._max_attempts = max_attempts
+        self._executor = executor
+        self._session = session or self._make_session()
+        self._queue = None
+        # An embed taken off the queue that didn't fit in the last batch, it starts the next one
+        self._held = None
+        self._task = None
+        self._logger = logging.getLogger("reviewfeed.delivery")
+        metrics.gauge("reviewfeed_delivery_queue_depth", "Embeds waiting for delivery", lambda: self.depth)
+
+    @staticmethod
+    def _make_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def depth(self):
+        return (self._queue.qsize() if self._queue else 0) + (self._held is not None)
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    async def submit(self, embed):
+        self.start()
+        await self._queue.put(embed)
+
+    async def flush(self):
+        """Wait until everything queued so far was delivered or dead-lettered."""
+        if self._queue:
+            await self._queue.join()
+
+    async def stop(self):
+        await self.flush()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _next_batch(self):
+        if self._held is not None:
+            batch, self._held = [self._held], None
+        else:
+            batch = [await self._queue.get()]
+        size = embed_size(batch[0])
+        deadline = time.monotonic() + self._linger
+        while len(batch) < self._batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                embed = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if size + embed_size(embed) > MAX_CHARS:
+                self._held = embed
+                break
+            batch.append(embed)
+            size += embed_size(embed)
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._deliver(batch)
+            except Exception as e:
+                self._logger.error(f"Unexpected error delivering {len(batch)} embeds: {e}")
+                self._write_dead_letter(batch, None, repr(e))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _post(self, batch):
+        return self._session.post(self._url, json={"embeds": batch}, timeout=30)
+
+    async def _deliver(self, batch):
+        loop = asyncio.get_running_loop()
+        delay = BACKOFF
+        status, error = None, None
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                with metrics.timed("reviewfeed_webhook_seconds", "webhook calls"):
+                    response = await loop.run_in_executor(self._executor, self._post, batch)
+            except requests.RequestException as e:
+                status, error, wait = None, str(e), delay
+            else:
+                status = response.status_code
+                metrics.counter("reviewfeed_webhook_responses_total", "Webhook responses", status=status).inc()
+                if 200 <= status < 300:
+                    self._logger.info(f"Delivered {len(batch)} embeds (code {status})")
+                    return
+                error = response.text[:500]
+                if status == 429:
+                    wait = self._retry_after(response, delay)
+                elif status >= 500:
+                    wait = delay
+                elif len(batch) > 1:
+                    # Rejected outright; one bad embed shouldn't take the rest of the batch down with it
+                    self._logger.warning(f"Batch of {len(batch)} embeds rejected ({status}), sending them one by one")
+                    for embed in batch:
+                        await self._deliver([embed])
+                    return
+                else:
+                    # Anything else is a problem with the payload itself, retrying won't help
+                    break
+            if attempt < self._max_attempts:
+                self._logger.warning(
+                    f"Delivery attempt {attempt} failed ({status or error}), retrying in {wait:.1f}s"
+                )
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, MAX_BACKOFF)
+        self._logger.error(f"Giving up on {len(batch)} embeds after code {status}: {error}")
+        self._write_dead_letter(batch, status, error)
+
+    @staticmethod
+    def _retry_after(response, default):
+        # Discord sends the delay in the JSON body (seconds, fractional) as well as the Retry-After header
+        try:
+            return float(response.json()["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            pass
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return default
+
+    def _write_dead_letter(self, batch, status, error):
+        metrics.counter("reviewfeed_dead_letters_total", "Embeds that could not be delivered").inc(len(batch))
+        if not self._dead_letter:
+            self._logger.error(f"Dropped undeliverable embeds: {json.dumps(batch)}")
+            return
+        record = {"time": time.time(), "status": status, "error": error, "embeds": batch}
+        with open(self._dead_letter, "a") as fout:
+            fout.write(json.dumps(record) + "\n")
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from elmerbot.metrics import metrics
+
+
+class PoolBusy(Exception):
+    """Raised instead of queueing more work once max_pending tasks are already waiting or running."""
+
+
+def _timed(func, *args):
+    # Module level so it can be pickled for process pools. time.monotonic is system wide on the platforms we run on,
+    # so timestamps taken in a worker process can be compared with the parent's.
+    started = time.monotonic()
+    result = func(*args)
+    return started, time.monotonic(), result
+
+
+class WorkPool(object):
+    """Execution layer for CPU-bound work that must not run on the discord event loop.
+
+    run() sends work to a thread or process pool and refuses new work with PoolBusy once max_pending tasks are
+    outstanding, so a burst of slow queries degrades into "try again" replies instead of an ever growing backlog.
+    submit() runs background jobs (like data reloads) on a separate thread so they never compete for those slots.
+    Queue wait and execution time are exported per task name as the elmerbot_pool_wait_seconds and
+    elmerbot_pool_run_seconds histograms.
+    """
+
+    def __init__(self, kind="thread", workers=None, max_pending=32):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown pool kind: {kind}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        if kind == "process":
+            # Not forked: by now this process runs the log writer and reload threads, which a fork would copy mid-flight
+            # (the same reason shards are spawned)
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        else:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="elmer-work")
+        self._background = ThreadPoolExecutor(1, thread_name_prefix="elmer-background")
+        # run() counts on the event loop and call() on the background thread
+        self._pending_lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+        self._logger = logging.getLogger("elmerbot.pool")
+
+    @classmethod
+    def from_settings(cls, settings):
+        settings = settings or {}
+        return cls(settings.get("kind", "thread"), settings.get("workers"), settings.get("max_pending", 32))
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _record(self, name, submitted, started, finished):
+        wait, elapsed = max(0.0, started - submitted), finished - started
+        metrics.histogram("elmerbot_pool_wait_seconds", "Time work pool tasks spent queued", task=name).observe(wait)
+        metrics.histogram("elmerbot_pool_run_seconds", "Time work pool tasks spent running", task=name).observe(
+            elapsed
+        )
+        self._logger.debug(f"{name}: waited {wait * 1000:.1f}ms, ran {elapsed * 1000:.1f}ms")
+
+    def _acquire(self):
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PoolBusy()
+            self._pending += 1
+
+    def _release(self):
+        with self._pending_lock:
+            self._pending -= 1
+
+    async def run(self, func, *args, name=None):
+        self._acquire()
+        name = name or getattr(func, "__name__", "task")
+        submitted = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            started, finished, result = await loop.run_in_executor(self._executor, _timed, func, *args)
+        finally:
+            self._release()
+        self._record(name, submitted, started, finished)
+        return result
+
+    def call(self, func, *args, name=None):
+        """Run func in the pool and block until it finishes, with the same slot limit and timing as run(). Only for
+        use off the event loop (e.g. from submit()).
+        """
+        self._acquire()
+        name = name or getattr(func, "__name__", "task")
+        submitted = time.monotonic()
+        try:
+            started, finished, result = self._executor.submit(_timed, func, *args).result()
+        finally:
+            self._release()
+        self._record(name, submitted, started, finished)
+        return result
+
+    def submit(self, func, *args, name=None):
+        """Run func on the background thread. Returns a concurrent.futures.Future."""
+        name = name or getattr(func, "__name__", "task")
+        submitted = time.monotonic()
+
+        def job():
+            started, finished, result = _timed(func, *args)
+            self._record(name, submitted, started, finished)
+            return result
+
+        return self._background.submit(job)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        self._background.shutdown(wait=False)
@@ -1,12 +1,19 @@
+import asyncio
 import configargparse
 import logging
 import praw
-import requests
+import threading
 import time
 import traceback
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from elmerbot.delivery import WebhookDelivery
+from elmerbot.history import FeedHistory
 from elmerbot.logs import configure_logger
+from elmerbot.metrics import metrics
+from elmerbot.scheduler import PollScheduler, TimerQueue
+from operator import attrgetter
+from praw.models import MoreComments
 from prawcore.exceptions import RequestException, ResponseException, OAuthException
 
 
@@ -16,32 +23,192 @@ FEED_NAME = "elmerdiscord"
 FEED_VERSION = "2.0.0"
 USER_AGENT = f"python:{FEED_NAME}:{FEED_VERSION}"
 default_subs = ["bourbon", "scotch", "worldwhisky"]
+HISTORY_FILE = "reviewfeed.db"
+# Consecutive empty polls after which the cursor post is checked for removal
+CURSOR_CHECK_AFTER = 3
+# Review comment extraction: comments in the first page, and the most API calls and bytes spent per submission
+COMMENT_LIMIT = 50
+COMMENT_CALLS = 3
+COMMENT_BYTES = 512 * 1024
+# Subreddit polls per minute, shared by all subreddits
+POLL_BUDGET = 30
+# Attempts at handling a submission before it is given up on, so one broken post can't hold a cursor back forever
+MAX_ATTEMPTS = 5
 
 
 class ReviewFeed(object):
-    def __init__(self, subreddits, user, webhook, delay):
+    """Polls each subreddit on its own adaptive schedule and hands matching submissions to a bounded set of workers,
+    so a slow subreddit or comment tree doesn't hold up the others. PRAW is blocking, so all of its calls run in a
+    thread pool; everything else happens on the event loop. Embeds are sent through a WebhookDelivery queue.
+    """
+
+    def __init__(
+        self,
+        subreddits,
+        user,
+        webhook,
+        delay,
+        metrics_file=None,
+        workers=4,
+        interval=60,
+        dead_letter_file=None,
+        history_file=HISTORY_FILE,
+        comment_calls=COMMENT_CALLS,
+        comment_bytes=COMMENT_BYTES,
+        poll_budget=POLL_BUDGET,
+    ):
         self._logger = logging.getLogger("reviewfeed.worker")
-        self._history = defaultdict(dict)
+        self._history = FeedHistory(history_file)
         self._user = user
         self._delay = delay
-        self._webhook_url = webhook
         self._subreddits = subreddits
-        self._reddit = None
+        self._metrics_file = metrics_file
+        self._workers = workers
+        self._interval = interval
+        self._comment_calls = comment_calls
+        self._comment_bytes = comment_bytes
+        # Submissions being handled or waiting out the delay, so later polls don't pick them up again
+        self._in_flight = set()
+        # Failed handling attempts per submission id
+        self._attempts = {}
+        # Consecutive empty polls per subreddit
+        self._empty_polls = {}
+        self._tasks = set()
+        self._scheduler = PollScheduler(subreddits, budget=poll_budget, initial_interval=interval)
+        self._events = TimerQueue()
+        self._wakeup = None
+        for key in ("rate_per_hour", "interval", "limit"):
+            metrics.gauge(
+                f"reviewfeed_poll_{key}",
+                f"Scheduler {key.replace('_', ' ')} per subreddit",
+                lambda key=key: {
+                    (("subreddit", name),): plan[key] for name, plan in self._scheduler.stats().items()
+                },
+            )
+        # PRAW isn't thread safe, so every pool thread gets its own Reddit instance. Bumping the generation makes them
+        # all reconnect.
+        self._local = threading.local()
+        self._generation = 0
+        self._executor = ThreadPoolExecutor(len(subreddits) + workers + 1, thread_name_prefix="reviewfeed")
+        self._delivery = WebhookDelivery(webhook, dead_letter_file, executor=self._executor)
+        self._slots = None
         self._refresh_reddit_client()
 
     def start(self):
         try:
-            while True:
-                start = time.time()
-                self._check_submissions()
-                # Try to only run this once a minute
-                cooldown = max(0, 60 - (time.time() - start))
-                self._logger.debug(f"Sleeping {cooldown:.2f} seconds")
-                time.sleep(cooldown)
+            asyncio.run(self.run())
         except KeyboardInterrupt:
             self._logger.warning("Exiting due to interrupt received")
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def run(self):
+        """Everything is driven from one timer queue: subreddit polls (rescheduled by the PollScheduler after each
+        one finishes), submissions waiting out --delay, and metrics file writes.
+        """
+        self._slots = asyncio.Semaphore(self._workers)
+        self._wakeup = asyncio.Event()
+        self._delivery.start()
+        now = time.time()
+        for sub in self._subreddits:
+            self._schedule(now, ("poll", sub))
+        if self._metrics_file:
+            self._schedule(now + self._interval, ("metrics", None))
+        try:
+            while True:
+                self._wakeup.clear()
+                due = self._events.next_due()
+                timeout = None if due is None else max(0, due - time.time())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                for kind, payload in self._events.pop_due(time.time()):
+                    if kind == "poll":
+                        self._spawn(self._poll(payload))
+                    elif kind == "wait":
+                        self._in_flight.discard(payload[1])
+                        self._dispatch(*payload)
+                    elif kind == "metrics":
+                        try:
+                            metrics.write_file(self._metrics_file)
+                        except OSError as e:
+                            self._logger.error(f"Could not write metrics to {self._metrics_file}: {e}")
+                        self._schedule(time.time() + self._interval, ("metrics", None))
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await self._delivery.stop()
+            self._history.close()
+
+    def _call(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
 
-    def _handle_submission(self, submission):
+    def _client(self):
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            local.reddit = praw.Reddit(self._user, check_for_updates=False, user_agent=USER_AGENT)
+            local.generation = self._generation
+            local.calls = local.bytes = 0
+            # Count every response this thread's client receives, so extraction costs can be measured and capped
+            core = local.reddit._core
+            requestor = getattr(core, "requestor", None) or core._requestor
+            requestor._http.hooks["response"].append(self._count_response)
+        return local.reddit
+
+    def _count_response(self, response, *args, **kwargs):
+        self._local.calls += 1
+        self._local.bytes += len(response.content)
+
+    def _find_review_comment(self, submission):
+        """The author's earliest top-level comment, looking at as few comments as possible: the first page is fetched
+        oldest first, scanning stops at the first match and "load more" links are only followed while the call and
+        byte budget lasts. Author replies deeper in the tree are only used if they were already downloaded.
+        """
+        local = self._local
+        calls, received = local.calls, local.bytes
+        submission.comment_sort = "old"
+        submission.comment_limit = COMMENT_LIMIT
+        # Accessing the comments fetches the submission together with the first page
+        pending = list(submission.comments)
+        author = submission.author
+        review_comment = None
+        nested = None
+        exhausted = False
+        while pending and review_comment is None:
+            item = pending.pop(0)
+            if isinstance(item, MoreComments):
+                if local.calls - calls >= self._comment_calls or local.bytes - received >= self._comment_bytes:
+                    exhausted = True
+                    break
+                pending[:0] = [comment for comment in item.comments() if comment.parent_id == submission.fullname]
+            elif item.author == author:
+                review_comment = item
+            elif nested is None:
+                replies = [reply for reply in item.replies.list() if not isinstance(reply, MoreComments)]
+                by_author = [reply for reply in replies if reply.author == author]
+                nested = min(by_author, key=attrgetter("created_utc"), default=None)
+        calls, received = local.calls - calls, local.bytes - received
+        metrics.histogram(
+            "reviewfeed_extract_calls", "API calls per review comment extraction", buckets=(1, 2, 3, 5, 10)
+        ).observe(calls)
+        metrics.histogram(
+            "reviewfeed_extract_bytes",
+            "Bytes downloaded per review comment extraction",
+            buckets=(16384, 65536, 262144, 1048576, 4194304),
+        ).observe(received)
+        if exhausted:
+            metrics.counter("reviewfeed_extract_exhausted_total", "Extractions that ran out of budget").inc()
+        self._logger.info(
+            f"Comment extraction for {submission.id}: {calls} calls, {received} bytes, "
+            f"{'found' if review_comment or nested else 'not found'}{' (budget exhausted)' if exhausted else ''}"
+        )
+        return review_comment or nested
+
+    def _render_submission(self, submission_id):
+        # Loaded through this thread's own client; the comment fetch loads the submission itself as well
+        submission = self._client().submission(id=submission_id)
+        review_comment = self._find_review_comment(submission)
         human_time = datetime.utcfromtimestamp(submission.created_utc).strftime("%Y-%m-%d %H:%M")
         self._logger.info(f'Handling submission {submission.id} "{submission.title}" ({human_time})')
         embed = {
@@ -52,63 +219,154 @@ class ReviewFeed(object):
             ),
             "thumbnail": {"url": submission.thumbnail},
         }
-        # Search for oldest comment from author. There should be a way to do this directly with PRAW, but I don't
-        # see it, so just doing a linear search for now...
-        submission.comments.replace_more(limit=0)
-        oldest = None
-        review_comment = None
-        for comment in submission.comments.list():
-            if comment.author == submission.author:
-                if not oldest or comment.created < oldest:
-                    oldest = comment.created
-                    review_comment = comment
         if review_comment:
             body = review_comment.body if len(review_comment.body) <= 400 else review_comment.body[:400] + "..."
             embed["description"] += ":\n\n" + body
-        response = requests.post(self._webhook_url, json={"embeds": [embed]})
-        self._logger.info(f"Submitted and got code {response.status_code} and body: {response.content.decode()}")
-        if response.status_code != 204:
-            print(embed)
+        return embed
+
+    async def _run_handler(self, sub, submission_id):
+        try:
+            async with self._slots:
+                with metrics.timed("reviewfeed_submission_seconds", "submission handling"):
+                    embed = await self._call(self._render_submission, submission_id)
+            # From here on the delivery queue is responsible for it, including retries and dead-lettering
+            await self._delivery.submit(embed)
+            self._logger.debug(f"Added {submission_id} to history.")
+            self._history.mark(sub, submission_id, "posted")
+            self._attempts.pop(submission_id, None)
+        except RequestException as re:
+            self._logger.error(f"Error handling submission {submission_id}, will retry: {re}")
+            self._generation += 1
+            self._failed(sub, submission_id)
+        except Exception as e:
+            self._logger.error(f"Unknown exception handling submission {submission_id}, will retry: {e}")
+            traceback.print_exc()
+            self._failed(sub, submission_id)
+        finally:
+            self._in_flight.discard(submission_id)
+
+    def _failed(self, sub, submission_id):
+        attempts = self._attempts.get(submission_id, 0) + 1
+        if attempts < MAX_ATTEMPTS:
+            self._attempts[submission_id] = attempts
+            return
+        # Decided as failed so the cursor can move past it
+        self._logger.error(f"Giving up on submission {submission_id} after {attempts} attempts")
+        metrics.counter("reviewfeed_failed_total", "Submissions given up on after repeated errors").inc()
+        self._history.mark(sub, submission_id, "failed")
+        self._attempts.pop(submission_id, None)
+
+    def _schedule(self, due, event):
+        if self._events.push(due, event) and self._wakeup:
+            self._wakeup.set()
 
-    def _check_submissions(self):
-        self._logger.debug("Checking submissions")
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _dispatch(self, sub, submission_id):
+        self._in_flight.add(submission_id)
+        self._spawn(self._run_handler(sub, submission_id))
+
+    async def _poll(self, sub):
         start = time.time()
         try:
-            for sub in self._subreddits:
-                seen = set()
-                for submission in self._reddit.subreddit(sub).new(limit=20):
-                    seen.add(submission.id)
-                    if start - submission.created_utc > 3600:
-                        # Skip really old ones on the first run
-                        continue
-                    if submission.id not in self._history[sub]:
-                        if start - submission.created_utc < self._delay:
-                            self._logger.debug(f'Skipping "{submission.title}" as too new')
-                        else:
-                            if "review" not in submission.title.lower():
-                                self._logger.info(f'Skipping "{submission.title}" as not likely being a review')
-                            else:
-                                self._handle_submission(submission)
-                            self._logger.debug(f"Added {submission.id} to history.")
-                            self._history[sub][submission.id] = start
-                # Now prune everything from history that wasn't seen (replaced by newer ones)
-                history_submissions = set(self._history[sub].keys())
-                for submission in history_submissions - seen:
-                    self._history[sub].pop(submission)
-                    self._logger.debug(f"Removed {submission} from history.")
+            with metrics.timed("reviewfeed_check_seconds", "submission checks"):
+                checked = await self._check_subreddit(sub, start)
+            if checked is not None:
+                created_times, calls = checked
+                self._scheduler.record(sub, created_times, start, calls)
+        finally:
+            interval, limit = self._scheduler.plan(sub)
+            self._logger.debug(f"Next poll of r/{sub} in {interval:.0f}s for up to {limit} posts")
+            self._schedule(start + interval, ("poll", sub))
+
+    def _list_new(self, sub, limit, before=None):
+        # Only what's newer than the cursor when there is one
+        params = {"before": before} if before else None
+        listing = self._client().subreddit(sub).new(limit=limit, params=params)
+        return [
+            (submission.id, submission.name, submission.title, submission.created_utc) for submission in listing
+        ]
+
+    def _cursor_removed(self, fullname):
+        # One small lookup by id; a removed or deleted post still comes back, marked with why it was removed
+        posts = list(self._client().info(fullnames=[fullname]))
+        return not posts or getattr(posts[0], "removed_by_category", None) is not None
+
+    async def _check_subreddit(self, sub, start):
+        """Poll one subreddit and act on what it returns. Returns the creation times of the listed posts and the
+        number of API calls made, or None if the poll failed.
+        """
+        cursor = self._history.cursor(sub)
+        first_run = cursor is None
+        # Everything at or before this was decided by an earlier run
+        decided_until = cursor[1] if cursor else None
+        limit = self._scheduler.plan(sub)[1]
+        calls = 1
+        try:
+            with metrics.timed("reviewfeed_poll_seconds", "subreddit polls", subreddit=sub):
+                submissions = await self._call(self._list_new, sub, limit, cursor[0] if cursor else None)
+                empty = self._empty_polls.get(sub, 0) + 1 if not submissions else 0
+                self._empty_polls[sub] = empty
+                if cursor and empty >= CURSOR_CHECK_AFTER:
+                    # Empty both when the sub is quiet and when the cursor post was removed, since listing before a
+                    # removed post never returns anything. After a few empty polls, look at the cursor post itself.
+                    self._empty_polls[sub] = 0
+                    calls += 1
+                    if await self._call(self._cursor_removed, cursor[0]):
+                        self._logger.info(f"Resetting r/{sub} cursor {cursor[0]}, the post was removed")
+                        self._history.clear_cursor(sub)
+                        calls += 1
+                        submissions = await self._call(self._list_new, sub, limit)
         except RequestException as re:
             # PRAW routinely experiences problems and stops working. Refresh our session when this happens.
-            self._logger.error(f"Error encountered during submission check: {re}")
-            self._refresh_reddit_client()
-            time.sleep(1)
+            self._logger.error(f"Error encountered checking r/{sub}: {re}")
+            self._generation += 1
+            return None
         except Exception as e:
-            self._logger.error(f"Unknown exception: {e}")
+            self._logger.error(f"Unknown exception checking r/{sub}: {e}")
             traceback.print_exc()
+            return None
+        # Oldest first, so the cursor can move up to the first submission that still needs deciding
+        advancing = True
+        for submission_id, fullname, title, created_utc in reversed(submissions):
+            decided = True
+            if submission_id in self._in_flight:
+                decided = False
+            elif self._history.is_processed(submission_id):
+                pass
+            elif decided_until is not None and created_utc <= decided_until:
+                pass
+            elif first_run and start - created_utc > 3600:
+                # Skip really old ones on the first run
+                self._history.mark(sub, submission_id, "old")
+            elif "review" not in title.lower():
+                self._logger.info(f'Skipping "{title}" as not likely being a review')
+                self._logger.debug(f"Added {submission_id} to history.")
+                self._history.mark(sub, submission_id, "skipped")
+            elif start - created_utc < self._delay:
+                # Give the author time to post their review comment. Held in flight so later polls leave it alone.
+                self._logger.debug(f'Waiting on "{title}" as too new')
+                self._in_flight.add(submission_id)
+                self._schedule(created_utc + self._delay, ("wait", (sub, submission_id)))
+                decided = False
+            else:
+                # Added to history once handled, so failures get retried next cycle
+                self._dispatch(sub, submission_id)
+                decided = False
+            advancing = advancing and decided
+            if advancing:
+                self._history.set_cursor(sub, fullname, created_utc)
+        return [created_utc for _, _, _, created_utc in submissions], calls
 
     def _refresh_reddit_client(self):
+        # Connects once up front so bad credentials stop the feed right away instead of failing every poll
         try:
-            self._reddit = praw.Reddit(self._user, check_for_updates=False, user_agent=USER_AGENT)
-            self._logger.info(f"Reconnected to reddit as {self._reddit.user.me().name}")
+            self._generation += 1
+            reddit = praw.Reddit(self._user, check_for_updates=False, user_agent=USER_AGENT)
+            self._logger.info(f"Connected to reddit as {reddit.user.me().name}")
         except ResponseException:
             self._logger.error("Application ID or secret not recognized")
             raise
@@ -128,17 +386,37 @@ def main():
     parser.add("-u", "--user", help="praw.ini section if not default", default="default")
     parser.add("-s", "--subreddits", help="Extra subs to include", action="append", default=default_subs)
     parser.add("-v", "--verbose", help="Show verbose information.", action="store_true")
+    parser.add("--log-json", help="Log JSON lines instead of text", action="store_true")
     parser.add("-w", "--webhook", help="Webhook URL", required=True)
+    parser.add("-m", "--metrics-file", help="Write Prometheus metrics to this file every minute")
+    parser.add("-p", "--workers", help="Submissions handled at the same time", type=int, default=4)
+    parser.add("--dead-letter-file", help="Append embeds that could not be delivered to this file (JSON lines)")
+    parser.add("--history-file", help="SQLite file remembering handled posts across restarts", default=HISTORY_FILE)
+    parser.add("--comment-calls", help="Most API calls spent finding a review comment", type=int, default=COMMENT_CALLS)
+    parser.add("--comment-bytes", help="Most bytes spent finding a review comment", type=int, default=COMMENT_BYTES)
+    parser.add("--poll-budget", help="Subreddit polls per minute, all subs together", type=int, default=POLL_BUDGET)
     args = parser.parse_args()
 
-    configure_logger("reviewfeed", logging.DEBUG if args.verbose else logging.INFO)
+    configure_logger("reviewfeed", logging.DEBUG if args.verbose else logging.INFO, json_lines=args.log_json)
     logger = logging.getLogger("reviewfeed.main")
     logger.info(f"Starting review feed to: {args.webhook}")
     logger.info(f"Using user agent: {USER_AGENT}")
     logger.info(f"Subreddits being monitored: {', '.join(args.subreddits)}")
 
     try:
-        feed = ReviewFeed(list(set(args.subreddits)), args.user, args.webhook, args.delay)
+        feed = ReviewFeed(
+            list(set(args.subreddits)),
+            args.user,
+            args.webhook,
+            args.delay,
+            args.metrics_file,
+            args.workers,
+            dead_letter_file=args.dead_letter_file,
+            history_file=args.history_file,
+            comment_calls=args.comment_calls,
+            comment_bytes=args.comment_bytes,
+            poll_budget=args.poll_budget,
+        )
         feed.start()
     except Exception as e:
         logger.error(f"Terminating due to exception")
@@ -0,0 +1,67 @@
+import sqlite3
+import time
+
+
+# Decisions are only needed while a submission can still show up in a listing, so older ones get compacted away
+RETENTION = 30 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    id TEXT PRIMARY KEY,
+    subreddit TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    decided_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS processed_decided_at ON processed (decided_at);
+CREATE TABLE IF NOT EXISTS cursors (
+    subreddit TEXT PRIMARY KEY,
+    fullname TEXT NOT NULL,
+    created_utc REAL NOT NULL
+);
+"""
+
+
+class FeedHistory(object):
+    """Durable record of which submissions the feed has decided on (posted or skipped) plus a cursor per subreddit:
+    the newest submission such that it and everything older has been decided. Polls ask reddit only for what's newer
+    than the cursor, and a restart picks up exactly where the last run stopped.
+
+    Only used from the event loop thread.
+    """
+
+    def __init__(self, path, retention=RETENTION):
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self.compact(retention)
+
+    def compact(self, retention=RETENTION):
+        self._db.execute("DELETE FROM processed WHERE decided_at < ?", (time.time() - retention,))
+
+    def is_processed(self, submission_id):
+        row = self._db.execute("SELECT 1 FROM processed WHERE id = ?", (submission_id,)).fetchone()
+        return row is not None
+
+    def mark(self, subreddit, submission_id, outcome):
+        self._db.execute(
+            "INSERT OR REPLACE INTO processed (id, subreddit, outcome, decided_at) VALUES (?, ?, ?, ?)",
+            (submission_id, subreddit, outcome, time.time()),
+        )
+
+    def cursor(self, subreddit):
+        """(fullname, created_utc) of the subreddit's cursor, or None before its first poll."""
+        return self._db.execute(
+            "SELECT fullname, created_utc FROM cursors WHERE subreddit = ?", (subreddit,)
+        ).fetchone()
+
+    def set_cursor(self, subreddit, fullname, created_utc):
+        self._db.execute(
+            "INSERT OR REPLACE INTO cursors (subreddit, fullname, created_utc) VALUES (?, ?, ?)",
+            (subreddit, fullname, created_utc),
+        )
+
+    def clear_cursor(self, subreddit):
+        self._db.execute("DELETE FROM cursors WHERE subreddit = ?", (subreddit,))
+
+    def close(self):
+        self._db.close()
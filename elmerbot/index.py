@@ -0,0 +1,102 @@
+import re
+from array import array
+from collections import defaultdict
+import numpy as np
+
+
+non_alnum_pattern = re.compile(r"[^a-z0-9]+")
+# Names handed to the fuzzy scorer per search. The scoring cost grows with this.
+MAX_CANDIDATES = 150
+# Postings counted per search to pick them. Grams are used rarest first until this is spent, so picking candidates
+# costs about the same however large the catalogue grows.
+MAX_POSTINGS = 50000
+
+
+def normalize(text):
+    return non_alnum_pattern.sub(" ", text.lower()).strip()
+
+
+def trigrams(text):
+    """Character trigrams of each word, padded the same way as pg_trgm ("  w", " wo", "wor", "ord", "rd ") so short
+    words and word boundaries still produce grams.
+    """
+    grams = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        for idx in range(len(padded) - 2):
+            grams.add(padded[idx : idx + 3])
+    return grams
+
+
+class TrigramIndex(object):
+    """Inverted index from trigrams to name positions, used to pick a small candidate set before running the
+    (expensive) fuzzy scorer. Candidates are returned in their original order so ties are broken the same way as a
+    full scan would break them.
+    """
+
+    def __init__(self, size, grams, offsets, postings, gram_counts, max_postings=MAX_POSTINGS):
+        # Postings for grams[i] are postings[offsets[i]:offsets[i + 1]]. Keeping them in flat arrays lets the index
+        # be stored in (and used straight from) a memory-mapped snapshot.
+        self.size = size
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.gram_counts = gram_counts
+        self._lookup = {gram: idx for idx, gram in enumerate(grams)}
+        self._max_postings = max_postings
+        # Zero-copy views for counting, also when the arrays live in a snapshot
+        self._postings = np.frombuffer(postings, dtype=np.uint32)
+        self._gram_counts = np.frombuffer(gram_counts, dtype=np.uint16)
+
+    @classmethod
+    def build(cls, names, **kwargs):
+        gram_counts = array("H")
+        positions = defaultdict(list)
+        for pos, name in enumerate(names):
+            grams = trigrams(name)
+            gram_counts.append(min(len(grams), 0xFFFF))
+            for gram in grams:
+                positions[gram].append(pos)
+        grams = sorted(positions)
+        offsets = array("I", [0])
+        postings = array("I")
+        for gram in grams:
+            postings.extend(positions[gram])
+            offsets.append(len(postings))
+        return cls(len(names), grams, offsets, postings, gram_counts, **kwargs)
+
+    def __len__(self):
+        return self.size
+
+    def candidates(self, pattern, limit=MAX_CANDIDATES):
+        """Return sorted positions of the (at most limit) names most likely to match pattern."""
+        if self.size <= limit:
+            # Nothing to gain from pruning
+            return range(self.size)
+        grams = [self._lookup[gram] for gram in trigrams(pattern) if gram in self._lookup]
+        grams.sort(key=self._posting_size)
+        if not grams:
+            return []
+        # The rarest grams say the most about which names match, and common ones (found in a good part of the
+        # catalogue) would make the count grow with it. The rarest gram is always used, however common.
+        used = grams[:1]
+        spent = self._posting_size(grams[0])
+        for gram in grams[1:]:
+            spent += self._posting_size(gram)
+            if spent > self._max_postings:
+                break
+            used.append(gram)
+        positions, overlap = np.unique(
+            np.concatenate([self._postings[self.offsets[gram] : self.offsets[gram + 1]] for gram in used]),
+            return_counts=True,
+        )
+        # Shortlist by raw overlap, then prefer names that don't have lots of extra grams (Jaccard similarity), which
+        # is much closer to how the fuzzy scorer will rank them. Both sorts are stable so ties go to earlier names.
+        shortlist = np.argsort(-overlap, kind="stable")[: limit * 4]
+        positions, overlap = positions[shortlist], overlap[shortlist]
+        jaccard = overlap / (len(grams) + self._gram_counts[positions].astype(np.int64) - overlap)
+        best = positions[np.argsort(-jaccard, kind="stable")[:limit]]
+        return np.sort(best).tolist()
+
+    def _posting_size(self, gram):
+        return self.offsets[gram + 1] - self.offsets[gram]
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+# Discord's limit on message length
+MESSAGE_LIMIT = 2000
+
+
+class ActionQueue(object):
+    """Runs Discord API actions (bans, role changes, messages) from a queue with a fixed number of workers, spaced at
+    no more than rate actions per second overall, so bursts turn into a steady stream instead of a pile of 429s.
+    Tracks queue depth and how long each backlog took to drain.
+    """
+
+    def __init__(self, concurrency=2, rate=4.0):
+        self._concurrency = concurrency
+        self._interval = 1.0 / rate
+        self._queue = None
+        self._workers = []
+        self._next_slot = 0.0
+        self._active = 0
+        self._busy_since = None
+        self.processed = 0
+        self.failed = 0
+        self.last_drain_time = None
+        self._logger = logging.getLogger("elmerbot.actions")
+
+    def _ensure_queue(self):
+        # Created on first use rather than in start(), since actions can be queued before the workers are running
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    def start(self):
+        if self._workers:
+            return
+        self._ensure_queue()
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self._concurrency)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def put(self, name, func, *args):
+        if self._busy_since is None:
+            self._busy_since = time.monotonic()
+        self._ensure_queue().put_nowait((name, func, args))
+
+    async def _pace(self):
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _worker(self):
+        while True:
+            name, func, args = await self._queue.get()
+            self._active += 1
+            try:
+                await self._pace()
+                await func(*args)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                self._logger.error(f"Action {name} failed: {e}")
+            finally:
+                self._active -= 1
+                self._queue.task_done()
+                if not self._active and self._queue.empty() and self._busy_since is not None:
+                    self.last_drain_time = time.monotonic() - self._busy_since
+                    self._busy_since = None
+                    self._logger.info(f"Action queue drained in {self.last_drain_time:.2f}s")
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "active": self._active,
+            "processed": self.processed,
+            "failed": self.failed,
+            "last_drain_seconds": self.last_drain_time,
+        }
+
+
+class JoinScheduler(object):
+    """Handles member joins without making API calls in the event handler itself. Spammer bans and role assignments
+    go through an ActionQueue. Greetings are sent one per member normally, but once more than burst_threshold members
+    join within burst_window seconds (a raid or a big influx) they are collected and sent as one message mentioning
+    everyone every greeting_interval seconds.
+    """
+
+    def __init__(self, client, settings=None):
+        settings = settings or {}
+        self._client = client
+        self._burst_threshold = settings.get("burst_threshold", 5)
+        self._burst_window = settings.get("burst_window", 10)
+        self._greeting_interval = settings.get("greeting_interval", 30)
+        self.actions = ActionQueue(settings.get("concurrency", 2), settings.get("rate", 4.0))
+        self._joins = deque()
+        self._pending_greetings = []
+        # Ids of members with a ban queued or running, so repeated updates of a spammer don't queue more bans
+        self._pending_bans = set()
+        self._greeter = None
+        self.raid_mode = False
+        self._logger = logging.getLogger("elmerbot.joins")
+
+    def start(self):
+        self.actions.start()
+        if self._greeter is None:
+            self._greeter = asyncio.ensure_future(self._greet_periodically())
+
+    def _update_raid_mode(self, now):
+        while self._joins and now - self._joins[0] > self._burst_window:
+            self._joins.popleft()
+        raid_mode = len(self._joins) > self._burst_threshold
+        if raid_mode != self.raid_mode:
+            self._logger.warning(f"Raid mode {'on' if raid_mode else 'off'}: {len(self._joins)} recent joins")
+            self.raid_mode = raid_mode
+
+    def member_joined(self, member, spammer=False):
+        now = time.monotonic()
+        self._joins.append(now)
+        self._update_raid_mode(now)
+        if spammer:
+            self.ban(member)
+            return
+        role = self._client.newuser_role
+        if role:
+            self.actions.put("add_role", member.add_roles, role)
+        if self._client.greeting_channel:
+            if self.raid_mode:
+                self._pending_greetings.append(member)
+            else:
+                self.actions.put("greeting", self._send_greeting, [member])
+
+    def ban(self, member):
+        if member.id in self._pending_bans:
+            return
+        self.actions.put("ban", self._ban, member)
+        self._pending_bans.add(member.id)
+
+    async def _ban(self, member):
+        try:
+            await self._client.ban_spammer(member)
+        finally:
+            # A failed ban can be queued again by the member's next update
+            self._pending_bans.discard(member.id)
+
+    async def _send_greeting(self, members):
+        mentions = ", ".join(member.mention for member in members)
+        await self._client.greeting_channel.send("{}, {}!".format(self._client.greeting, mentions))
+
+    def _flush_greetings(self):
+        members, self._pending_greetings = self._pending_greetings, []
+        batch = []
+        length = len(self._client.greeting) + 3
+        for member in members:
+            if batch and length + len(member.mention) + 2 > MESSAGE_LIMIT:
+                self.actions.put("greeting", self._send_greeting, batch)
+                batch = []
+                length = len(self._client.greeting) + 3
+            batch.append(member)
+            length += len(member.mention) + 2
+        if batch:
+            self.actions.put("greeting", self._send_greeting, batch)
+        if members:
+            self._logger.info(f"Sent a batched greeting to {len(members)} members")
+
+    async def _greet_periodically(self):
+        while True:
+            await asyncio.sleep(self._greeting_interval)
+            try:
+                self._update_raid_mode(time.monotonic())
+                self._flush_greetings()
+            except Exception as e:
+                self._logger.error(f"Error sending batched greetings: {e}")
+
+    def stats(self):
+        stats = self.actions.stats()
+        stats.update(
+            {
+                "raid_mode": int(self.raid_mode),
+                "pending_greetings": len(self._pending_greetings),
+                "pending_bans": len(self._pending_bans),
+            }
+        )
+        return stats
@@ -1,14 +1,134 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 
 
-def configure_logger(logger_name, level, filename=None):
+TEXT_FORMAT = "%(levelname)s:%(asctime)s.%(msecs)03d:%(name)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Always present in JSON lines output (null when a record doesn't set them through extra=)
+JSON_FIELDS = ("event", "guild", "command", "latency")
+
+# logger name -> (queue handler, listener) for everything configure_logger set up
+_pipelines = {}
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with a fixed set of fields, so log processors don't have to parse messages."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in JSON_FIELDS:
+            entry[field] = getattr(record, field, None)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """Like QueueHandler, but keeps exc_info on the queued record so the listener's formatter still gets to format the
+    traceback (JsonFormatter puts it in its own field). Records never leave the process, so they needn't pickle.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # Merged now, in case the arguments change before the listener gets to the record
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Per-logger token buckets. limits maps a logger name (which covers its children) to a dict with rate (records
+    per second), burst and optionally sample: once a logger is over its limit only every sample-th record gets through
+    (none without sample). The next record let through notes how many were dropped.
+    """
+
+    def __init__(self, limits):
+        super(RateLimitFilter, self).__init__()
+        self._limits = {name: dict(limit) for name, limit in limits.items()}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _limit_for(self, name):
+        while name:
+            if name in self._limits:
+                return name, self._limits[name]
+            name = name.rpartition(".")[0]
+        return None, None
+
+    def filter(self, record):
+        name, limit = self._limit_for(record.name)
+        if limit is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(name, {"tokens": limit.get("burst", 10), "at": now, "dropped": 0})
+            burst = limit.get("burst", 10)
+            bucket["tokens"] = min(burst, bucket["tokens"] + (now - bucket["at"]) * limit.get("rate", 1))
+            bucket["at"] = now
+            if bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+            else:
+                bucket["dropped"] += 1
+                sample = limit.get("sample")
+                if not sample or bucket["dropped"] % sample:
+                    return False
+                # Let through as the sample, so not dropped after all
+                bucket["dropped"] -= 1
+            dropped, bucket["dropped"] = bucket["dropped"], 0
+        if dropped:
+            record.msg = f"{record.getMessage()} [{dropped} similar messages rate limited]"
+            record.args = None
+        return True
+
+
+def stop_logging():
+    """Flush and stop every background writer."""
+    with _lock:
+        for logger_name, (handler, listener) in list(_pipelines.items()):
+            logging.getLogger(logger_name).removeHandler(handler)
+            listener.stop()
+        _pipelines.clear()
+
+
+atexit.register(stop_logging)
+
+
+def configure_logger(logger_name, level, filename=None, json_lines=False, rate_limits=None):
+    """Log through a queue: callers only enqueue the record and a background thread does the formatting and I/O.
+    Safe to call again, which replaces the previous setup instead of stacking handlers.
+    """
     logger = logging.getLogger(logger_name)
     logger.setLevel(level)
-    formatter = logging.Formatter("%(levelname)s:%(asctime)s.%(msecs)03d:%(name)s - %(message)s", "%Y-%m-%d %H:%M:%S")
+    formatter = JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    handlers = []
     if filename:
-        fh = logging.FileHandler(filename)
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
-    sh = logging.StreamHandler()
-    sh.setFormatter(formatter)
-    logger.addHandler(sh)
+        handlers.append(logging.FileHandler(filename))
+    handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = RecordQueueHandler(queue.SimpleQueue())
+    if rate_limits:
+        # Filtered before enqueueing, so dropped records cost next to nothing
+        queue_handler.addFilter(RateLimitFilter(rate_limits))
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    with _lock:
+        previous = _pipelines.pop(logger_name, None)
+        if previous:
+            logger.removeHandler(previous[0])
+            previous[1].stop()
+        listener.start()
+        logger.addHandler(queue_handler)
+        _pipelines[logger_name] = (queue_handler, listener)
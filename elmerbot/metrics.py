@@ -0,0 +1,200 @@
+import asyncio
+import bisect
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = ('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter(object):
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name):
+        yield f"{name}{_format_labels(self.labels)} {self.value}"
+
+
+class Histogram(object):
+    def __init__(self, labels, buckets=DEFAULT_BUCKETS):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            yield f"{name}_bucket{_format_labels(self.labels, {'le': bound})} {cumulative}"
+        yield f"{name}_sum{_format_labels(self.labels)} {total}"
+        yield f"{name}_count{_format_labels(self.labels)} {count}"
+
+
+class Timer(object):
+    """Context manager recording elapsed seconds into a histogram and counting exceptions."""
+
+    def __init__(self, histogram, errors):
+        self._histogram = histogram
+        self._errors = errors
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._start)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            self._errors.inc()
+        return False
+
+
+class MetricsRegistry(object):
+    """Process wide collection of counters, histograms and gauges, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help, labels, factory):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, {"kind": kind, "help": help, "children": {}})
+            child = family["children"].get(labels)
+            if child is None:
+                child = family["children"][labels] = factory(labels)
+        return child
+
+    def counter(self, name, help, **labels):
+        return self._get("counter", name, help, labels, Counter)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get("histogram", name, help, labels, lambda labels: Histogram(labels, buckets))
+
+    def gauge(self, name, help, func):
+        """Register a gauge read at render time. func returns a number, or a dict of label tuples to numbers."""
+        with self._lock:
+            self._families[name] = {"kind": "gauge", "help": help, "func": func}
+
+    def timed(self, name, help, **labels):
+        """Time a block into the histogram name (which should end in _seconds) and count its errors."""
+        errors_name = name[: -len("_seconds")] + "_errors_total" if name.endswith("_seconds") else name + "_errors"
+        return Timer(self.histogram(name, help, **labels), self.counter(errors_name, f"Errors in {help}", **labels))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = sorted(self._families.items())
+        for name, family in families:
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            if family["kind"] == "gauge":
+                try:
+                    value = family["func"]()
+                except Exception as e:
+                    logging.getLogger("elmerbot.metrics").error(f"Gauge {name} failed: {e}")
+                    continue
+                values = value if isinstance(value, dict) else {(): value}
+                for labels, item in values.items():
+                    lines.append(f"{name}{_format_labels(labels)} {item if item is not None else 'NaN'}")
+                continue
+            for child in list(family["children"].values()):
+                lines.extend(child.render(name))
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """Atomically write the current metrics to path, e.g. for node_exporter's textfile collector."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as fout:
+                fout.write(self.render())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+metrics = MetricsRegistry()
+
+
+async def monitor_event_loop(interval=0.5, registry=None):
+    """Measure how late the event loop wakes up compared to when it was scheduled to. Anything blocking the loop
+    shows up here as lag.
+    """
+    lag = (registry or metrics).histogram(
+        "elmerbot_event_loop_lag_seconds", "Event loop wakeup delay compared to schedule"
+    )
+    loop = asyncio.get_event_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag.observe(max(0.0, loop.time() - scheduled))
+
+
+async def write_periodically(path, interval=15, registry=None):
+    logger = logging.getLogger("elmerbot.metrics")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            (registry or metrics).write_file(path)
+        except OSError as e:
+            logger.error(f"Could not write metrics to {path}: {e}")
+
+
+async def serve(host="127.0.0.1", port=9108, registry=None):
+    """Serve the metrics over plain HTTP for Prometheus to scrape. Any path returns the metrics."""
+
+    async def handle(reader, writer):
+        try:
+            # Read and discard the request line and headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = (registry or metrics).render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def start(settings):
+    """Start the loop lag monitor plus the HTTP endpoint and/or metrics file from the metrics settings."""
+    tasks = [asyncio.ensure_future(monitor_event_loop(settings.get("lag_interval", 0.5)))]
+    if "port" in settings:
+        tasks.append(asyncio.ensure_future(serve(settings.get("host", "127.0.0.1"), settings["port"])))
+    if "file" in settings:
+        tasks.append(asyncio.ensure_future(write_periodically(settings["file"], settings.get("interval", 15))))
+    return tasks
@@ -1,23 +1,51 @@
 import logging
-from elmerbot import RegisteredClass
+import re
+from elmerbot.plugins import Plugin, PluginSet
 
 
-class ElmerParser(object, metaclass=RegisteredClass):
-    """Provides a base class for parsers to inherit."""
+# Flags that can be scoped to part of a pattern with (?flags:...)
+SCOPED_FLAGS = {re.IGNORECASE: "i", re.MULTILINE: "m", re.DOTALL: "s", re.VERBOSE: "x"}
+
+
+class ElmerParser(object):
+    """Provides a base class for parsers to inherit. Parsers set pattern to a compiled regex that matches every message
+    they might handle; all enabled patterns are merged into one regex so most messages are rejected by a single search.
+
+    Parsers are declared in plugins below. Disabled ones are never imported, enabled ones are loaded when the first
+    message is checked.
+    """
 
     name = None
-    enabled = False
+    pattern = None
 
     def __init__(self):
         self._logger = logging.getLogger("elmerbot.{}-parser".format(self.name or "noname"))
 
     def check(self, contents):
-        raise NotImplementedError
+        return self.pattern.search(contents)
+
+    @classmethod
+    def enabled_parsers(cls):
+        return plugins.load_all()
+
+    @classmethod
+    def combined_pattern(cls):
+        """One regex matching anything any enabled parser's pattern matches, or None if no parser is enabled."""
+        if "_combined" not in cls.__dict__:
+            parts = []
+            for parser in cls.enabled_parsers():
+                flags = "".join(flag for value, flag in SCOPED_FLAGS.items() if parser.pattern.flags & value)
+                parts.append(f"(?{flags}:{parser.pattern.pattern})" if flags else f"(?:{parser.pattern.pattern})")
+            cls._combined = re.compile("|".join(parts)) if parts else None
+        return cls._combined
 
     async def handle(self, client, message):
         raise NotImplementedError
 
 
-# Load subclasses and register them
-# 6 Nov 2020 - Removing this for now until I have time to find a working API
-from elmerbot.parsers.currency import *
+plugins = PluginSet(
+    [
+        # 6 Nov 2020 - Removing this for now until I have time to find a working API
+        Plugin("currency", "elmerbot.parsers.currency:CurrencyParser", enabled=False),
+    ]
+)
@@ -1,8 +1,8 @@
-import arrow
+import asyncio
 import discord
 import re
 from elmerbot.parsers import ElmerParser
-from forex_python.converter import CurrencyRates
+from elmerbot import rates
 
 
 __all__ = ["CurrencyParser"]
@@ -10,43 +10,37 @@ __all__ = ["CurrencyParser"]
 
 class CurrencyParser(ElmerParser):
     name = "currency"
-    enabled = False
+    currencies = ["USD", "EUR", "GBP", "SGD", "CAD", "AUD", "DKK", "HKD", "NZD"]
 
-    def __init__(self):
+    def __init__(self, provider=None):
         super(CurrencyParser, self).__init__()
-        self._last_refreshed = 0
-        self._cache = {}
-        self._rates = CurrencyRates()
-        self._currencies = ["USD", "EUR", "GBP", "SGD", "CAD", "AUD", "DKK", "HKD", "NZD"]
-        self._pattern = re.compile(r"(\d+[\.,]?\d*)\s+(" + "|".join(self._currencies) + r")", re.IGNORECASE)
-
-    def _get_unit(self, unit):
-        # Force refresh every 10 minutes
-        now = arrow.get().timestamp
-        if now - self._last_refreshed > 600:
-            self._cache = {}
-            self._last_refreshed = now
-        if unit not in self._cache:
-            self._cache[unit] = self._rates.get_rates(unit)
-        return self._cache[unit]
-
-    def check(self, contents):
-        return self._pattern.search(contents)
+        # Rates are refreshed in the background; handle only reads the latest matrix. The provider comes from the
+        # currency settings (see rates.configure) unless one is passed in.
+        self._rates = rates.RateService(provider or rates.provider, self.currencies)
+        self.pattern = re.compile(r"(\d+[\.,]?\d*)\s+(" + "|".join(self.currencies) + r")", re.IGNORECASE)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Not loaded from the bot's event loop; the refresh starts with the first message instead
+            pass
+        else:
+            self._rates.start()
 
     async def handle(self, client, message):
         self._logger.info("Parsing message...")
+        self._rates.start()
 
-        amount, unit = self._pattern.search(message.content).groups(1)
+        amount, unit = self.pattern.search(message.content).groups(1)
         amount = float(amount.replace(",", "."))
         unit = unit.upper()
 
+        matrix = self._rates.matrix
+        if matrix is None or unit not in matrix:
+            self._logger.info("No exchange rates available yet")
+            return
         em = discord.Embed(
             title="{:.2f} {}".format(amount, unit), description="Currency Conversion Table", color=0x00DD00
         )
-        rates = self._get_unit(unit)
-        rates[unit] = 1
-        for other_unit in self._currencies:
-            display_value = str(rates[other_unit]).zfill(2)
-            display_value = "{:.2f}".format(amount * rates[other_unit])
-            em.add_field(name=other_unit, value=display_value)
+        for other_unit, value in matrix.convert(amount, unit):
+            em.add_field(name=other_unit, value="{:.2f}".format(value))
         await message.channel.send(embed=em)
@@ -0,0 +1,91 @@
+import importlib
+import logging
+import time
+from elmerbot import STARTED
+
+
+class StartupProfile(object):
+    """Records how long each plugin took to import and instantiate, and when each one (and the client) was ready,
+    relative to the elmerbot package being imported.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.modules = []
+        self._logger = logging.getLogger("elmerbot.startup")
+
+    def mark(self, stage):
+        self.stages.append((stage, time.perf_counter() - STARTED))
+
+    def record(self, plugin, import_time, init_time):
+        self.modules.append((plugin, import_time, init_time, time.perf_counter() - STARTED))
+
+    def report(self):
+        lines = ["Startup profile (seconds since elmerbot was imported):"]
+        for stage, at in self.stages:
+            lines.append(f"  {stage:<44} ready at {at:8.3f}")
+        for plugin, import_time, init_time, at in self.modules:
+            lines.append(
+                f"  {plugin.target:<44} ready at {at:8.3f}  import {import_time * 1000:8.1f}ms  "
+                f"init {init_time * 1000:6.1f}ms"
+            )
+        return "\n".join(lines)
+
+    def log_report(self):
+        self._logger.info(self.report())
+
+
+startup = StartupProfile()
+
+
+class Plugin(object):
+    """A command or parser declared by "module:Class" target plus the metadata needed to route to it, so the module
+    is only imported the first time the plugin is actually used, and never if it is disabled.
+    """
+
+    def __init__(self, name, target, aliases=(), enabled=True):
+        self.name = name
+        self.target = target
+        self.aliases = tuple(aliases)
+        self.enabled = enabled
+        self._instance = None
+
+    @property
+    def loaded(self):
+        return self._instance is not None
+
+    def load(self):
+        if self._instance is None:
+            module_name, _, attr = self.target.partition(":")
+            started = time.perf_counter()
+            module = importlib.import_module(module_name)
+            imported = time.perf_counter()
+            self._instance = getattr(module, attr)()
+            startup.record(self, imported - started, time.perf_counter() - imported)
+        return self._instance
+
+
+class PluginSet(object):
+    """The plugins of one kind, in declaration order."""
+
+    def __init__(self, plugins):
+        self._plugins = list(plugins)
+        self._routes = {}
+        for plugin in self._plugins:
+            if plugin.enabled:
+                for name in (plugin.name,) + plugin.aliases:
+                    self._routes[name] = plugin
+
+    def __iter__(self):
+        return iter(self._plugins)
+
+    def enabled(self):
+        return [plugin for plugin in self._plugins if plugin.enabled]
+
+    def find(self, name):
+        """The loaded plugin object for a name or alias, or None if there is no such enabled plugin."""
+        plugin = self._routes.get(name)
+        return plugin.load() if plugin else None
+
+    def load_all(self):
+        return [plugin.load() for plugin in self.enabled()]
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import numpy
+import time
+
+
+REFRESH_INTERVAL = 600
+RETRY_DELAY = 60
+
+
+class ForexProvider(object):
+    """Rates from forex_python, imported on first use so nothing pulls it in unless it is actually configured."""
+
+    def __init__(self):
+        self._rates = None
+
+    def fetch(self, base):
+        if self._rates is None:
+            from forex_python.converter import CurrencyRates
+
+            self._rates = CurrencyRates()
+        return self._rates.get_rates(base)
+
+
+class StaticProvider(object):
+    """Fixed rates, for tests and offline use. rates maps currency to units per one unit of base."""
+
+    def __init__(self, rates, base="USD"):
+        self._rates = dict(rates)
+        self._base = base
+
+    def fetch(self, base):
+        rates = dict(self._rates, **{self._base: 1.0})
+        if base != self._base:
+            rates = {currency: rate / rates[base] for currency, rate in rates.items()}
+        return rates
+
+
+class FileProvider(object):
+    """Rates from a JSON file like {"base": "USD", "rates": {"EUR": 0.92, ...}}, re-read on every refresh."""
+
+    def __init__(self, path):
+        self._path = path
+
+    def fetch(self, base):
+        with open(self._path) as fin:
+            data = json.load(fin)
+        return StaticProvider(data["rates"], data.get("base", "USD")).fetch(base)
+
+
+def provider_from_settings(settings=None):
+    """The provider a currency settings section asks for: rates_file reads a FileProvider's JSON file, rates (with
+    an optional base) are fixed StaticProvider rates, and anything else uses forex_python.
+    """
+    settings = settings or {}
+    if "rates_file" in settings:
+        return FileProvider(settings["rates_file"])
+    if "rates" in settings:
+        return StaticProvider(settings["rates"], settings.get("base", "USD"))
+    return ForexProvider()
+
+
+provider = ForexProvider()
+
+
+def configure(settings):
+    """Set the provider the currency parser uses from a currency settings section."""
+    global provider
+    provider = provider_from_settings(settings)
+    return provider
+
+
+class RateMatrix(object):
+    """Every cross rate between the currencies, derived from one table of rates against a single base. Read only,
+    so it can be shared freely between messages.
+    """
+
+    def __init__(self, currencies, base_rates, fetched_at=None):
+        self.currencies = tuple(currency for currency in currencies if base_rates.get(currency))
+        self.fetched_at = fetched_at or time.time()
+        self._index = {currency: idx for idx, currency in enumerate(self.currencies)}
+        # Units of each currency per base unit, so 1 unit of row currency = matrix[row, col] units of col currency
+        units = numpy.array([float(base_rates[currency]) for currency in self.currencies])
+        self._matrix = units[numpy.newaxis, :] / units[:, numpy.newaxis]
+        self._matrix.setflags(write=False)
+
+    def __contains__(self, currency):
+        return currency in self._index
+
+    def rate(self, source, target):
+        return float(self._matrix[self._index[source], self._index[target]])
+
+    def convert(self, amount, source):
+        """[(currency, amount in that currency)] for every currency, in order."""
+        row = self._matrix[self._index[source]] * amount
+        return list(zip(self.currencies, row.tolist()))
+
+
+class RateService(object):
+    """Keeps a RateMatrix fresh with one bulk fetch of the base table per refresh, run in the background. Readers
+    only ever look at the last published matrix, so answering a conversion never touches the network.
+    """
+
+    def __init__(self, provider, currencies, base="USD", refresh_interval=REFRESH_INTERVAL):
+        self._provider = provider
+        self._currencies = tuple(currencies)
+        self._base = base
+        self._refresh_interval = refresh_interval
+        self._task = None
+        self.matrix = None
+        self._logger = logging.getLogger("elmerbot.rates")
+
+    def start(self):
+        """Start the background refresh loop if it isn't running. Needs a running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def refresh(self):
+        """Fetch the base table and publish a new matrix. Blocking."""
+        rates = self._provider.fetch(self._base)
+        matrix = RateMatrix(self._currencies, dict(rates, **{self._base: 1.0}))
+        missing = set(self._currencies) - set(matrix.currencies)
+        if missing:
+            self._logger.warning(f"No rates for {', '.join(sorted(missing))}")
+        self.matrix = matrix
+        return matrix
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.refresh)
+                self._logger.info(f"Refreshed exchange rates for {len(self.matrix.currencies)} currencies")
+                delay = self._refresh_interval
+            except Exception as e:
+                # Keep answering from the last matrix we had
+                self._logger.error(f"Error refreshing exchange rates: {e}")
+                delay = RETRY_DELAY
+            await asyncio.sleep(delay)
@@ -1,136 +1,460 @@
-import arrow
+import asyncio
 import csv
+import datetime
+import functools
 import io
-import json
 import logging
 import os
+import re
 import requests
-import statistics
-from collections import defaultdict
-from fuzzywuzzy import process
+import threading
+import time
+from elmerbot.analytics import RatingsEngine
+from elmerbot.cache import LRUCache, SingleFlight
+from elmerbot.executor import PoolBusy, WorkPool
+from elmerbot.index import MAX_CANDIDATES, TrigramIndex
+from elmerbot.metrics import metrics
+from elmerbot.snapshot import SnapshotError, SnapshotFile, load_snapshot, write_snapshot
+from elmerbot.store import ReviewStoreBuilder
+from fuzzywuzzy import process, utils
 
 
 SPREADSHEET_URL = (
     "https://docs.google.com/spreadsheets/export?format=csv&id=1X1HTxkI6SqsdpNSkSSivMzpxNT-oeTbjFFDdEkXD30o"
 )
+CACHE_PATH = "/tmp/review_cache.snapshot"
+# How long a snapshot is served before a background revalidation is started
+CACHE_TTL = 3600
+# How long to wait before trying again after a failed refresh
+RETRY_DELAY = 60
+# How often followers check the snapshot file for a new version
+FOLLOW_INTERVAL = 30
+SEARCH_CACHE_SIZE = 512
+RENDER_CACHE_SIZE = 256
 
 
+# Month, divider, day, year, where any divider may be doubled (11//29/15) but all dividers have to be the same
+date_pattern = re.compile(r"\s*(\d{1,2})\s*([/.-])\2?\s*(\d{1,2})\s*\2\2?\s*(\d{1,4})\s*")
+
+
+@functools.lru_cache(maxsize=8192)
 def parse_date(date):
     # The dates are inconsistent but are approximately MM/DD/YY
     # Some of them also have repeated slashes (11//29/15)
     # Others use . or - as dividers
     # For the ones that are completely unsalvageable, just put 1 Jan 2000
+    # The sheet only has a few thousand distinct date strings, so results are memoized.
+    match = date_pattern.fullmatch(date)
+    if not match:
+        return "2000-01-01"
+    m, _, d, y = match.groups()
+    year = int(y)
+    if year < 1000:
+        year += 2000
     try:
-        divider = "/"
-        if "-" in date:
-            divider = "-"
-        elif "." in date:
-            divider = "."
-        divider = "/" if "/" in date else "-"
-        m, d, y = [int(f) for f in date.replace(divider * 2, divider).split(divider)]
-        if y < 2000:
-            y += 2000
-        clean_str = "{}/{}/{}".format(str(m).zfill(2), str(d).zfill(2), y)
-        return arrow.get(clean_str).format("YYYY-MM-DD")
-    except:
+        return datetime.date(year, int(m), int(d)).isoformat()
+    except ValueError:
         return "2000-01-01"
 
 
+def parse_reviews(text):
+    """Parse the spreadsheet CSV into a ReviewStore. Module level so it can run in a process pool worker."""
+    buff = io.StringIO(text)
+    reader = csv.DictReader(buff, delimiter=",", quotechar='"')
+
+    builder = ReviewStoreBuilder()
+    for idx, row in enumerate(reader):
+        try:
+            rating = int(row["Reviewer Rating"].strip())
+        except:
+            rating = None
+        builder.add(
+            row["Whisky Name"].strip(),
+            row["Reviewer's Reddit Username"].strip(),
+            row["Link To Reddit Review"].strip(),
+            row["Full Bottle Price Paid"] or "",
+            parse_date(row["Date of Review"]),
+            rating,
+            idx,
+        )
+    return builder.build()
+
+
+def search_names(names, index, key, max_candidates=MAX_CANDIDATES):
+    pattern, matches, _ = key
+    # Only score the names that share the most trigrams with the pattern instead of scanning the whole catalogue.
+    # Passing a dict makes fuzzywuzzy hand back the position as well, which is the id minus one.
+    choices = {pos: names[pos] for pos in index.candidates(pattern, max_candidates)}
+    results = process.extractBests(pattern, choices, processor=lambda x: x, limit=matches, score_cutoff=70)
+    return tuple((result, pos + 1, conf) for result, conf, pos in results)
+
+
+# Snapshot files mapped by this process when it is a process pool worker: path -> (file identity, names, index)
+_worker_snapshots = {}
+
+
+def search_snapshot_file(path, key, max_candidates=MAX_CANDIDATES):
+    """Search entry point for process pool workers, which can't share the parent's snapshot object. Each worker maps
+    the snapshot file itself and only rebuilds its index when the file has been replaced.
+    """
+    stat = os.stat(path)
+    identity = (stat.st_ino, stat.st_mtime_ns)
+    cached = _worker_snapshots.get(path)
+    if cached is None or cached[0] != identity:
+        data = load_snapshot(path)
+        names = data.store.names
+        cached = (identity, names, data.index or TrigramIndex.build(names))
+        _worker_snapshots[path] = cached
+    return search_names(cached[1], cached[2], key, max_candidates)
+
+
+def search_names_batch(names, index, keys, max_candidates=MAX_CANDIDATES):
+    return [search_names(names, index, key, max_candidates) for key in keys]
+
+
+def search_snapshot_file_batch(path, keys, max_candidates=MAX_CANDIDATES):
+    return [search_snapshot_file(path, key, max_candidates) for key in keys]
+
+
+class ReviewSnapshot(object):
+    """One fully built copy of the review sheet. ReviewData never mutates a published snapshot, it only swaps in a new
+    one, so readers on the event loop always see a consistent set of reviews, indexes and stats.
+    """
+
+    def __init__(self, store, stats=None, index=None):
+        self.store = store
+        self.version = 0
+        self.names = store.names
+        self.index = index or TrigramIndex.build(self.names)
+        self.analytics = RatingsEngine(store)
+        if stats:
+            self.avg = stats["avg"]
+            self.stddev = stats["stddev"]
+        else:
+            self.avg = round(float(self.analytics.mean), 2)
+            self.stddev = round(float(self.analytics.stddev), 2)
+
+    @property
+    def stats(self):
+        return {"avg": self.avg, "stddev": self.stddev}
+
+    def whisky_id(self, name):
+        pos = self.store.position(name)
+        return None if pos is None else pos + 1
+
+    def whisky_name(self, whisky_id):
+        if isinstance(whisky_id, int) and 0 < whisky_id <= len(self.names):
+            return self.names[whisky_id - 1]
+
+
 class ReviewData(object):
-    def __init__(self):
-        self._cache = None
-        self._expires = None
-        self._id_idx = {}
-        self._rev_id_idx = {}
-        self.avg = 0
-        self.stddev = 0
+    """Serves review data from the current snapshot while a background job keeps it fresh (stale-while-revalidate).
+    Refreshes use conditional requests so an unchanged spreadsheet costs a single round-trip and no parsing.
+
+    Parsing, reloads and search scoring all go through a WorkPool so none of it runs on the event loop.
+
+    With follower=True the data is only ever read from the snapshot file, which some other process keeps up to date
+    (see elmerbot.shards).
+    """
+
+    def __init__(
+        self,
+        cache_path=CACHE_PATH,
+        ttl=CACHE_TTL,
+        search_cache_size=SEARCH_CACHE_SIZE,
+        pool=None,
+        follower=False,
+        render_cache_size=RENDER_CACHE_SIZE,
+        max_candidates=MAX_CANDIDATES,
+    ):
+        self._cache_path = cache_path
+        self._follower = follower
+        self._identity = None
+        self._pool = pool or WorkPool()
+        self._ttl = ttl
+        self._snapshot = None
+        self._expires = 0
+        self._etag = None
+        self._last_modified = None
+        self._refresh_lock = threading.Lock()
+        self._refresh_future = None
+        self.version = 0
+        self._search_cache = LRUCache(search_cache_size)
+        self._search_flight = SingleFlight()
+        # Names scored per search, see TrigramIndex.candidates
+        self._max_candidates = max_candidates
+        # Finished response payloads keyed by (command, args, version), see ElmerCommand.cached_embed
+        self.render_cache = LRUCache(render_cache_size)
         self._logger = logging.getLogger("elmerbot.scraper")
 
-    def _build_id_index(self):
-        for idx, wname in enumerate(self._cache):
-            self._id_idx[wname] = idx + 1
-            self._rev_id_idx[idx + 1] = wname
+    def _publish(self, snapshot, expires):
+        # The version travels with the snapshot so cache keys can never pair old results with new data
+        snapshot.version = self.version + 1
+        # A single attribute assignment is atomic, so readers get either the old or the new snapshot, never a mix
+        self._snapshot = snapshot
+        self._expires = expires
+        self.version = snapshot.version
+        self._logger.info(f"Published review data version {self.version}, search cache: {self.search_cache_info()}")
+        self._search_cache.clear()
+        self.render_cache.clear()
 
-    def _compute_stats(self):
-        scores = []
-        for reviews in self._cache.values():
-            for review in reviews:
-                if review["rating"]:
-                    scores.append(review["rating"])
-        self.avg = round(statistics.mean(scores), 2)
-        self.stddev = round(statistics.stdev(scores), 2)
+    def _load_file_cache(self):
+        if not os.path.exists(self._cache_path):
+            return
+        self._logger.info("Loading from file cache...")
+        try:
+            data = load_snapshot(self._cache_path)
+        except (OSError, ValueError, SnapshotError) as e:
+            self._logger.warning(f"Ignoring unreadable file cache: {e}")
+            return
+        self._etag = data.etag
+        self._last_modified = data.last_modified
+        # Serve the file contents even if they have expired; they get revalidated right after
+        self._publish(ReviewSnapshot(data.store, data.stats, data.index), data.expiration)
+
+    def _follow(self):
+        # Followers never talk to the spreadsheet: another process owns the snapshot file and they just pick up each
+        # new version of it, mapping the same pages as every other follower
+        try:
+            stat = os.stat(self._cache_path)
+        except FileNotFoundError:
+            self._logger.info("Waiting for the review snapshot to be written...")
+            self._expires = time.time() + FOLLOW_INTERVAL
+            return
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        if identity != self._identity:
+            data = load_snapshot(self._cache_path)
+            self._identity = identity
+            self._publish(ReviewSnapshot(data.store, data.stats, data.index), time.time() + FOLLOW_INTERVAL)
+        else:
+            self._expires = time.time() + FOLLOW_INTERVAL
+
+    def _fetch(self):
+        headers = {}
+        if self._snapshot is not None:
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified:
+                headers["If-Modified-Since"] = self._last_modified
+        return requests.get(SPREADSHEET_URL, headers=headers, timeout=60)
 
     def _reload(self):
+        if self._follower:
+            self._follow()
+            return
         self._logger.info("Reloading review data...")
 
         # Try from cached file
-        if os.path.exists("/tmp/review_cache.json"):
-            self._logger.info("Loading from file cache...")
-            data = json.load(open("/tmp/review_cache.json"))
-            if arrow.get().timestamp < data["expiration"]:
-                self._cache = data["cache"]
-                self._expires = data["expiration"]
-                self._build_id_index()
-                self._compute_stats()
+        if self._snapshot is None:
+            self._load_file_cache()
+            if self._snapshot is not None and not self.stale:
                 return
 
-        response = requests.get(SPREADSHEET_URL)
+        response = self._fetch()
+        expires = time.time() + self._ttl
+        if response.status_code == 304:
+            self._logger.info("Review data not modified")
+            self._expires = expires
+            return
         if response.status_code != 200:
+            self._logger.warning(f"Review data request failed with code {response.status_code}")
             return
 
-        buff = io.StringIO(response.text)
-        reader = csv.DictReader(buff, delimiter=",", quotechar='"')
-
-        self._cache = defaultdict(list)
-        self._expires = arrow.get().shift(hours=1).timestamp
-
-        total = 0
-        for idx, row in enumerate(reader):
-            total += 1
-            entry = {
-                "name": row["Whisky Name"].strip(),
-                "username": row["Reviewer's Reddit Username"].strip(),
-                "link": row["Link To Reddit Review"].strip(),
-                "price": row["Full Bottle Price Paid"],
-                "date": parse_date(row["Date of Review"]),
-                "id": idx,
-            }
-            try:
-                entry["rating"] = int(row["Reviewer Rating"].strip())
-            except:
-                entry["rating"] = None
-            self._cache[row["Whisky Name"].strip()].append(entry)
-
-        self._build_id_index()
-        self._compute_stats()
-
-        with open("/tmp/review_cache.json", "w") as fout:
-            fout.write(json.dumps({"expiration": self._expires, "cache": self._cache}))
-        self._logger.info("Finished. {} reviews indexed".format(total))
+        # Takes a pool slot like any other job; with the pool full this raises PoolBusy and the reload backs off
+        store = self._pool.call(parse_reviews, response.text, name="parse")
+        self._etag = response.headers.get("ETag")
+        self._last_modified = response.headers.get("Last-Modified")
+        snapshot = ReviewSnapshot(store)
+        # Written before publishing so process pool workers never search an older file than the published snapshot
+        write_snapshot(
+            self._cache_path,
+            SnapshotFile(store, expires, self._etag, self._last_modified, snapshot.stats, snapshot.index),
+        )
+        self._publish(snapshot, expires)
+        self._logger.info("Finished. {} reviews indexed".format(store.row_count))
+
+    def _refresh_worker(self):
+        try:
+            with metrics.timed("elmerbot_reload_seconds", "review data reloads"):
+                self._reload()
+        except Exception as e:
+            self._logger.error(f"Error refreshing review data: {e}")
+        if self.stale:
+            # Keep serving what we have (if anything) and back off instead of retrying on every request
+            self._expires = time.time() + RETRY_DELAY
+
+    def refresh(self, wait=False):
+        """Start a background reload unless one is already running. Returns its concurrent.futures.Future."""
+        with self._refresh_lock:
+            if self._refresh_future is None or self._refresh_future.done():
+                self._refresh_future = self._pool.submit(self._refresh_worker, name="reload")
+            future = self._refresh_future
+        if wait:
+            future.result()
+        return future
+
+    async def ensure_loaded(self):
+        """Kick off a refresh if the data is stale. Only waits (off the event loop) when there is nothing to serve."""
+        if not self.stale:
+            return
+        future = self.refresh()
+        if self._snapshot is None:
+            await asyncio.wrap_future(future)
+
+    @property
+    def expires(self):
+        return self._expires
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
 
     @property
     def stale(self):
-        return not self._cache or arrow.get().timestamp >= self._expires
+        # With nothing loaded this only turns false while backing off after a failed load
+        return time.time() >= self._expires
 
     @property
-    def reviews(self):
+    def analytics(self):
+        return self._snapshot.analytics if self._snapshot else None
+
+    @property
+    def avg(self):
+        return self._snapshot.avg if self._snapshot else 0
+
+    @property
+    def stddev(self):
+        return self._snapshot.stddev if self._snapshot else 0
+
+    def _current(self):
+        # Never blocks: the refresh always happens in the background, and with nothing loaded yet this is None (callers
+        # on the event loop wait through ensure_loaded instead)
         if self.stale:
-            self._reload()
-        return self._cache
+            self.refresh()
+        return self._snapshot
+
+    @property
+    def reviews(self):
+        snapshot = self._current()
+        return snapshot.store if snapshot else {}
+
+    def search_cache_info(self):
+        info = self._search_cache.info()
+        info["coalesced"] = self._search_flight.coalesced
+        return info
+
+    def _search_key(self, snapshot, pattern, matches):
+        # The scorer only ever sees the fully processed pattern, so patterns that process the same share results
+        return (utils.full_process(pattern, force_ascii=True), matches, snapshot.version)
 
     def search(self, pattern, matches=5):
-        results = process.extractBests(
-            pattern, self.reviews.keys(), processor=lambda x: x, limit=matches, score_cutoff=70
-        )
-        return [(result, self._id_idx[result], conf) for result, conf in results]
+        snapshot = self._current()
+        if snapshot is None:
+            return []
+        key = self._search_key(snapshot, pattern, matches)
+        results = self._search_cache.get(key)
+        if results is None:
+            with metrics.timed("elmerbot_search_seconds", "search scoring", mode="sync"):
+                results = search_names(snapshot.names, snapshot.index, key, self._max_candidates)
+            self._search_cache.put(key, results)
+        return list(results)
+
+    async def asearch(self, pattern, matches=5):
+        """Like search, but scores in the work pool and coalesces identical concurrent searches. Raises PoolBusy when
+        the pool is saturated.
+        """
+        snapshot = self._current()
+        if snapshot is None:
+            return []
+        key = self._search_key(snapshot, pattern, matches)
+        results = self._search_cache.get(key)
+        if results is None:
+            results = await self._search_flight.run(key, self._pooled_search, snapshot, key)
+        return list(results)
+
+    async def search_many(self, patterns, matches=1):
+        """Resolve a batch of patterns at once. Patterns are deduplicated by their processed form, cached results are
+        reused and the rest is split into one chunk per pool worker and scored in parallel. Returns one result list
+        per input pattern, in order. Raises PoolBusy when the pool is saturated.
+        """
+        snapshot = self._current()
+        if snapshot is None:
+            return [[] for _ in patterns]
+        keys = [self._search_key(snapshot, pattern, matches) for pattern in patterns]
+        results = {}
+        for key in set(keys):
+            cached = self._search_cache.get(key)
+            if cached is not None:
+                results[key] = cached
+        missing = [key for key in set(keys) if key not in results]
+        if missing:
+            # One chunk per free worker, without taking more pool slots than are left
+            slots = min(self._pool.workers, self._pool.max_pending - self._pool.pending, len(missing))
+            if slots < 1:
+                raise PoolBusy()
+            size = -(-len(missing) // slots)
+            chunks = [missing[idx : idx + size] for idx in range(0, len(missing), size)]
+            if self._pool.kind == "process":
+                jobs = [
+                    self._pool.run(
+                        search_snapshot_file_batch, self._cache_path, chunk, self._max_candidates, name="search_many"
+                    )
+                    for chunk in chunks
+                ]
+            else:
+                jobs = [
+                    self._pool.run(
+                        search_names_batch,
+                        snapshot.names,
+                        snapshot.index,
+                        chunk,
+                        self._max_candidates,
+                        name="search_many",
+                    )
+                    for chunk in chunks
+                ]
+            for chunk, chunk_results in zip(chunks, await asyncio.gather(*jobs)):
+                for key, result in zip(chunk, chunk_results):
+                    self._search_cache.put(key, result)
+                    results[key] = result
+        return [list(results[key]) for key in keys]
+
+    async def _pooled_search(self, snapshot, key):
+        with metrics.timed("elmerbot_search_seconds", "search scoring", mode="pool"):
+            if self._pool.kind == "process":
+                results = await self._pool.run(
+                    search_snapshot_file, self._cache_path, key, self._max_candidates, name="search"
+                )
+            else:
+                results = await self._pool.run(
+                    search_names, snapshot.names, snapshot.index, key, self._max_candidates, name="search"
+                )
+        self._search_cache.put(key, results)
+        return results
 
     def find(self, whisky_id):
-        name = self._rev_id_idx.get(whisky_id)
-        return self._cache.get(name, [])
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.whisky_name(whisky_id) is None:
+            return []
+        return snapshot.store.rows(whisky_id - 1)
+
+    def whisky_name(self, whisky_id):
+        snapshot = self._snapshot
+        return snapshot.whisky_name(whisky_id) if snapshot else None
+
+    def summary(self, whisky_id):
+        """Precomputed aggregates for a whisky, or None if the id is unknown."""
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.whisky_name(whisky_id) is None:
+            return None
+        return snapshot.store.summary(whisky_id - 1)
 
     def most_recent(self, name=None, whisky_id=None, limit=5):
-        if not name:
-            name = self._rev_id_idx.get(whisky_id)
-        reviews = self._cache.get(name, [])
-        reviews.sort(key=lambda review: review["date"])
-        return reviews[::-1][:limit] if limit else reviews
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        if name:
+            whisky_id = snapshot.whisky_id(name)
+        if snapshot.whisky_name(whisky_id) is None:
+            return []
+        return snapshot.store.recent_rows(whisky_id - 1, limit)
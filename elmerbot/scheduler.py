@@ -0,0 +1,123 @@
+import heapq
+import itertools
+import math
+
+
+class TimerQueue(object):
+    """Items ordered by due time (a heap), for driving everything from one loop that sleeps until the next one."""
+
+    def __init__(self):
+        self._heap = []
+        # Tie breaker so items themselves never get compared
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, due, item):
+        """Returns True if the item is now the first one due, i.e. a sleeping loop should wake up early."""
+        heapq.heappush(self._heap, (due, next(self._counter), item))
+        return self._heap[0][2] is item
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+
+class SubredditRate(object):
+    def __init__(self, name, interval, limit):
+        self.name = name
+        # Estimated new posts per second (EWMA), None until the first poll
+        self.rate = None
+        self.interval = interval
+        self.limit = limit
+        self.last_poll = None
+        self.newest = None
+        self.saturated = False
+        # Reddit API calls per poll (EWMA), since a poll can take more than the one listing call
+        self.calls = 1.0
+
+
+class PollScheduler(object):
+    """Plans how often to poll each subreddit and how many posts to ask for, from its recent post arrival rate.
+
+    Each subreddit is polled often enough to see about target new posts per poll (clamped to the min/max interval),
+    and asks for a few times as many posts as it expects so a burst can't push any past the window. If the plans add
+    up to more than budget API calls per minute, every interval is stretched by the same factor.
+    """
+
+    def __init__(
+        self,
+        subreddits,
+        budget=30,
+        min_interval=30,
+        max_interval=300,
+        initial_interval=60,
+        target=3,
+        alpha=0.3,
+        min_limit=10,
+        max_limit=100,
+    ):
+        self._budget = budget
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._target = target
+        self._alpha = alpha
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self.subreddits = {name: SubredditRate(name, initial_interval, 20) for name in subreddits}
+
+    def plan(self, name):
+        """(interval, limit) for the next poll of the subreddit."""
+        sub = self.subreddits[name]
+        return sub.interval, sub.limit
+
+    def record(self, name, created_times, now, calls=1):
+        """Update the subreddit's rate from the creation times of the posts one poll returned, and its cost from the
+        number of API calls the poll made.
+        """
+        sub = self.subreddits[name]
+        sub.calls = self._alpha * calls + (1 - self._alpha) * sub.calls
+        # A full listing means there may be more waiting, so the next poll comes as soon as allowed
+        sub.saturated = len(created_times) >= sub.limit
+        if sub.last_poll is None:
+            # First poll: estimate from how far apart the posts in the listing are
+            if len(created_times) >= 2:
+                span = max(created_times) - min(created_times)
+                sub.rate = (len(created_times) - 1) / span if span > 0 else None
+        else:
+            new = sum(1 for created in created_times if sub.newest is None or created > sub.newest)
+            observed = new / max(now - sub.last_poll, 1)
+            sub.rate = observed if sub.rate is None else self._alpha * observed + (1 - self._alpha) * sub.rate
+        sub.last_poll = now
+        if created_times:
+            sub.newest = max(created_times + [sub.newest or 0])
+        self._rebalance()
+
+    def _rebalance(self):
+        for sub in self.subreddits.values():
+            if sub.saturated:
+                sub.interval = self._min_interval
+            elif sub.rate:
+                sub.interval = min(max(self._target / sub.rate, self._min_interval), self._max_interval)
+            elif sub.last_poll is not None:
+                sub.interval = self._max_interval
+        calls_per_minute = sum(60 / sub.interval * sub.calls for sub in self.subreddits.values())
+        if calls_per_minute > self._budget:
+            stretch = calls_per_minute / self._budget
+            for sub in self.subreddits.values():
+                sub.interval *= stretch
+        for sub in self.subreddits.values():
+            expected = (sub.rate or 0) * sub.interval
+            sub.limit = int(min(max(math.ceil(expected * 3), self._min_limit), self._max_limit))
+
+    def stats(self):
+        return {
+            name: {"rate_per_hour": round((sub.rate or 0) * 3600, 2), "interval": sub.interval, "limit": sub.limit}
+            for name, sub in self.subreddits.items()
+        }
@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import requests
+import time
+from elmerbot.client import ElmerBotClient
+from elmerbot.executor import WorkPool
+from elmerbot.logs import configure_logger
+from elmerbot.reviews import ReviewData
+
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# Restart backoff for crashed processes, doubling up to the maximum and reset once a process stays up for a while
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+HEALTHY_UPTIME = 600
+
+
+def recommended_shards(token):
+    """Ask Discord how many shards it wants this bot to run."""
+    response = requests.get(GATEWAY_URL, headers={"Authorization": f"Bot {token}"}, timeout=30)
+    response.raise_for_status()
+    return response.json()["shards"]
+
+
+def shard_settings(settings, shard_id):
+    """Per-shard copy of the settings, so every shard exports its own metrics."""
+    settings = dict(settings)
+    metrics = dict(settings.get("metrics", {}))
+    if "port" in metrics:
+        metrics["port"] += shard_id
+    if "file" in metrics:
+        metrics["file"] = f"{metrics['file']}.{shard_id}"
+    settings["metrics"] = metrics
+    return settings
+
+
+def run_loader(settings):
+    """Keep the review snapshot file fresh. This is the only process that talks to the spreadsheet; the shards just
+    map the file it writes.
+    """
+    configure_logger("elmerbot", logging.INFO, **settings.get("logging", {}))
+    logger = logging.getLogger("elmerbot.loader")
+    data = ReviewData(pool=WorkPool.from_settings(settings.get("pool")))
+    while True:
+        data.refresh(wait=True)
+        delay = max(1, data.expires - time.time())
+        logger.info(f"Next review data check in {delay:.0f}s")
+        time.sleep(delay)
+
+
+def run_shard(settings, shard_id, shard_count):
+    configure_logger("elmerbot", logging.INFO, **settings.get("logging", {}))
+    logging.getLogger("elmerbot.shards").info(f"Starting shard {shard_id} of {shard_count}")
+    client = ElmerBotClient(shard_settings(settings, shard_id), shard_id, shard_count, follower=True)
+    client.run()
+
+
+class Supervisor(object):
+    """Runs the review loader and one process per shard, restarting any that die with an exponential backoff."""
+
+    def __init__(self, settings, shard_count):
+        self._settings = settings
+        self._shard_count = shard_count
+        # Spawned rather than forked so children don't inherit the parent's threads or sockets. Not daemonic, since the
+        # children may run process pools of their own.
+        self._context = multiprocessing.get_context("spawn")
+        self._specs = {"loader": (run_loader, (settings,))}
+        for shard_id in range(shard_count):
+            self._specs[f"shard-{shard_id}"] = (run_shard, (settings, shard_id, shard_count))
+        self._processes = {}
+        self._started = {}
+        self._delays = {name: RESTART_DELAY for name in self._specs}
+        self._restart_at = {}
+        self._logger = logging.getLogger("elmerbot.shards")
+
+    def _start(self, name):
+        target, args = self._specs[name]
+        process = self._context.Process(target=target, args=args, name=f"elmerbot-{name}")
+        process.start()
+        self._processes[name] = process
+        self._started[name] = time.time()
+        self._logger.info(f"Started {name} (pid {process.pid})")
+
+    def _check(self):
+        now = time.time()
+        for name, process in self._processes.items():
+            if name in self._restart_at:
+                if now >= self._restart_at[name]:
+                    del self._restart_at[name]
+                    self._start(name)
+                continue
+            if process.is_alive():
+                if now - self._started[name] >= HEALTHY_UPTIME:
+                    self._delays[name] = RESTART_DELAY
+                continue
+            delay = self._delays[name]
+            self._delays[name] = min(delay * 2, MAX_RESTART_DELAY)
+            self._restart_at[name] = now + delay
+            self._logger.warning(f"{name} exited with code {process.exitcode}, restarting in {delay}s")
+
+    def run(self, interval=1):
+        # The loader goes first so the snapshot file usually exists by the time the shards want it
+        for name in self._specs:
+            self._start(name)
+        try:
+            while True:
+                time.sleep(interval)
+                self._check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(10)
+
+
+def run_sharded(settings, shards):
+    shard_count = recommended_shards(settings.get("token", "")) if shards == "auto" else int(shards)
+    Supervisor(settings, shard_count).run()
@@ -0,0 +1,156 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from elmerbot.index import TrigramIndex
+from elmerbot.store import ReviewStore, StringTable
+
+
+# Layout: fixed prefix (magic, format version, header length), a JSON header describing every section, then the raw
+# section bytes, each aligned to 8 bytes so they can be cast in place straight out of the memory map.
+MAGIC = b"ELMRSNAP"
+FORMAT_VERSION = 3
+PREFIX = struct.Struct("<8sII")
+ALIGNMENT = 8
+
+# name -> typecode ("B" for raw string blobs)
+ARRAY_SECTIONS = {
+    "starts": "I",
+    "whiskies": "I",
+    "user_idx": "I",
+    "ratings": "h",
+    "dates": "I",
+    "review_ids": "I",
+    "name_order": "I",
+    "recent": "I",
+    "rated_counts": "I",
+    "means": "d",
+    "min_ratings": "h",
+    "max_ratings": "h",
+    "last_dates": "I",
+}
+STRING_SECTIONS = ("names", "usernames", "links", "prices")
+INDEX_ARRAY_SECTIONS = {"offsets": "I", "postings": "I", "gram_counts": "H"}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotFile(object):
+    """A review store plus the metadata needed to serve and revalidate it."""
+
+    def __init__(self, store, expiration, etag=None, last_modified=None, stats=None, index=None):
+        self.store = store
+        self.index = index
+        self.expiration = expiration
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stats = stats or {}
+
+
+def _string_table(values):
+    return values if isinstance(values, StringTable) else StringTable.from_strings(values)
+
+
+def _sections(snapshot):
+    store = snapshot.store
+    for name, typecode in ARRAY_SECTIONS.items():
+        yield name, typecode, memoryview(getattr(store, name)).cast("B")
+    for name in STRING_SECTIONS:
+        table = _string_table(getattr(store, name))
+        yield f"{name}_blob", "B", memoryview(table.blob).cast("B")
+        yield f"{name}_offsets", "I", memoryview(table.offsets).cast("B")
+    if snapshot.index is not None:
+        for name, typecode in INDEX_ARRAY_SECTIONS.items():
+            yield f"index_{name}", typecode, memoryview(getattr(snapshot.index, name)).cast("B")
+        table = _string_table(snapshot.index.grams)
+        yield "index_grams_blob", "B", memoryview(table.blob).cast("B")
+        yield "index_grams_offsets", "I", memoryview(table.offsets).cast("B")
+
+
+def write_snapshot(path, snapshot):
+    """Write the snapshot next to path and atomically rename it into place, so readers (and a crash mid-write) never
+    see a partial file.
+    """
+    sections = list(_sections(snapshot))
+    layout = {}
+    offset = 0
+    for name, typecode, data in sections:
+        offset += -offset % ALIGNMENT
+        layout[name] = [typecode, offset, data.nbytes]
+        offset += data.nbytes
+    header = json.dumps(
+        {
+            "byteorder": sys.byteorder,
+            "expiration": snapshot.expiration,
+            "etag": snapshot.etag,
+            "last_modified": snapshot.last_modified,
+            "stats": snapshot.stats,
+            "sections": layout,
+        }
+    ).encode()
+    # Section offsets are relative to the aligned start of the data area
+    data_start = PREFIX.size + len(header)
+    data_start += -data_start % ALIGNMENT
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            fout.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            fout.write(header)
+            fout.write(b"\0" * (data_start - PREFIX.size - len(header)))
+            pos = 0
+            for name, _, data in sections:
+                start = layout[name][1]
+                fout.write(b"\0" * (start - pos))
+                fout.write(data)
+                pos = start + data.nbytes
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path):
+    """Memory-map a snapshot. Nothing is parsed besides the small JSON header; every column is a view into the map
+    and only the pages that get touched are read from disk.
+    """
+    with open(path, "rb") as fin:
+        mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mm) < PREFIX.size:
+        raise SnapshotError("Snapshot is truncated")
+    magic, version, header_len = PREFIX.unpack_from(mm)
+    if magic != MAGIC:
+        raise SnapshotError("Not a review snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    header = json.loads(mm[PREFIX.size : PREFIX.size + header_len])
+    if header["byteorder"] != sys.byteorder:
+        raise SnapshotError("Snapshot was written with a different byte order")
+    data_start = PREFIX.size + header_len
+    data_start += -data_start % ALIGNMENT
+
+    view = memoryview(mm)
+    columns = {}
+    for name, (typecode, offset, nbytes) in header["sections"].items():
+        start = data_start + offset
+        if start + nbytes > len(mm):
+            raise SnapshotError(f"Section {name} is truncated")
+        columns[name] = view[start : start + nbytes].cast(typecode)
+    for name in STRING_SECTIONS:
+        columns[name] = StringTable(columns.pop(f"{name}_blob"), columns.pop(f"{name}_offsets"))
+    index = None
+    if "index_postings" in columns:
+        index = TrigramIndex(
+            len(columns["names"]),
+            list(StringTable(columns.pop("index_grams_blob"), columns.pop("index_grams_offsets"))),
+            *(columns.pop(f"index_{name}") for name in INDEX_ARRAY_SECTIONS),
+        )
+    store = ReviewStore(**columns)
+    return SnapshotFile(store, header["expiration"], header["etag"], header["last_modified"], header["stats"], index)
@@ -0,0 +1,299 @@
+import sys
+from array import array
+from collections import namedtuple
+
+
+# Ratings are stored as signed shorts, so this marks a review without a usable score
+NO_RATING = -0x8000
+FIELDS = ("name", "username", "link", "price", "date", "id", "rating")
+
+WhiskySummary = namedtuple(
+    "WhiskySummary", ["id", "name", "count", "rated_count", "mean", "min_rating", "max_rating", "last_review"]
+)
+
+
+def date_key(date):
+    """Pack an ISO "YYYY-MM-DD" date into a sortable YYYYMMDD integer."""
+    return int(date[:4]) * 10000 + int(date[5:7]) * 100 + int(date[8:10])
+
+
+def format_date_key(key):
+    return f"{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}"
+
+
+class StringTable(object):
+    """Strings packed into one UTF-8 blob with an offsets array, so a million links cost one object instead of a
+    million. Items are decoded on access.
+    """
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        parts = []
+        offsets = array("I", [0])
+        pos = 0
+        for value in strings:
+            encoded = value.encode()
+            parts.append(encoded)
+            pos += len(encoded)
+            offsets.append(pos)
+        return cls(b"".join(parts), offsets)
+
+    @property
+    def blob(self):
+        return self._blob
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        return bytes(self._blob[self._offsets[idx] : self._offsets[idx + 1]]).decode()
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class Review(object):
+    """Lightweight view of one row of a ReviewStore. Supports review["field"] access like the dicts it replaces."""
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in FIELDS else default
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __repr__(self):
+        return f"Review({self.as_dict()})"
+
+    @property
+    def name(self):
+        return self._store.names[self._store.whiskies[self._row]]
+
+    @property
+    def username(self):
+        return self._store.usernames[self._store.user_idx[self._row]]
+
+    @property
+    def link(self):
+        return self._store.links[self._row]
+
+    @property
+    def price(self):
+        return self._store.prices[self._row]
+
+    @property
+    def date(self):
+        return format_date_key(self._store.dates[self._row])
+
+    @property
+    def id(self):
+        return self._store.review_ids[self._row]
+
+    @property
+    def rating(self):
+        rating = self._store.ratings[self._row]
+        return None if rating == NO_RATING else rating
+
+
+class ReviewStore(object):
+    """Columnar review storage. Rows are grouped by whisky, so the reviews for whisky position p are the rows in
+    [starts[p], starts[p + 1]). Whisky names and usernames are interned tables referenced by index, numeric fields
+    live in typed arrays and free-form strings in packed StringTables.
+
+    It behaves like the old name -> list of reviews mapping for the few places that need it. Name lookups binary
+    search name_order (whisky positions sorted by name) so no dict has to be built for a freshly mapped snapshot.
+
+    Per-whisky aggregates are computed once when the store is built: recent is a row permutation that orders each
+    whisky's range newest first, and the remaining columns hold one value per whisky.
+    """
+
+    def __init__(
+        self,
+        names,
+        starts,
+        whiskies,
+        usernames,
+        user_idx,
+        ratings,
+        dates,
+        review_ids,
+        links,
+        prices,
+        name_order,
+        recent,
+        rated_counts,
+        means,
+        min_ratings,
+        max_ratings,
+        last_dates,
+    ):
+        self.names = names
+        self.starts = starts
+        self.whiskies = whiskies
+        self.usernames = usernames
+        self.user_idx = user_idx
+        self.ratings = ratings
+        self.dates = dates
+        self.review_ids = review_ids
+        self.links = links
+        self.prices = prices
+        self.name_order = name_order
+        self.recent = recent
+        self.rated_counts = rated_counts
+        self.means = means
+        self.min_ratings = min_ratings
+        self.max_ratings = max_ratings
+        self.last_dates = last_dates
+
+    @property
+    def row_count(self):
+        return len(self.whiskies)
+
+    def position(self, name):
+        lo, hi = 0, len(self.name_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.names[self.name_order[mid]] < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.name_order) and self.names[self.name_order[lo]] == name:
+            return self.name_order[lo]
+
+    def rows(self, pos):
+        return [Review(self, row) for row in range(self.starts[pos], self.starts[pos + 1])]
+
+    def recent_rows(self, pos, limit=None):
+        start, end = self.starts[pos], self.starts[pos + 1]
+        if limit:
+            end = min(end, start + limit)
+        return [Review(self, row) for row in self.recent[start:end]]
+
+    def summary(self, pos):
+        return WhiskySummary(
+            pos + 1,
+            self.names[pos],
+            self.starts[pos + 1] - self.starts[pos],
+            self.rated_counts[pos],
+            self.means[pos] if self.rated_counts[pos] else None,
+            self.min_ratings[pos] if self.rated_counts[pos] else None,
+            self.max_ratings[pos] if self.rated_counts[pos] else None,
+            format_date_key(self.last_dates[pos]) if self.last_dates[pos] else None,
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return self.position(name) is not None
+
+    def keys(self):
+        return self.names
+
+    def get(self, name, default=None):
+        pos = self.position(name)
+        return default if pos is None else self.rows(pos)
+
+    def __getitem__(self, name):
+        pos = self.position(name)
+        if pos is None:
+            raise KeyError(name)
+        return self.rows(pos)
+
+
+class ReviewStoreBuilder(object):
+    """Accumulates rows in arrival order, then regroups them by whisky (first appearance order) in build()."""
+
+    def __init__(self):
+        self._names = {}
+        self._usernames = {}
+        self._whiskies = array("I")
+        self._user_idx = array("I")
+        self._ratings = array("h")
+        self._dates = array("I")
+        self._review_ids = array("I")
+        self._links = []
+        self._prices = []
+
+    def add(self, name, username, link, price, date, rating, review_id):
+        self._whiskies.append(self._names.setdefault(sys.intern(name), len(self._names)))
+        self._user_idx.append(self._usernames.setdefault(sys.intern(username), len(self._usernames)))
+        if rating is None or not NO_RATING < rating < 0x8000:
+            rating = NO_RATING
+        self._ratings.append(rating)
+        self._dates.append(date_key(date))
+        self._review_ids.append(review_id)
+        self._links.append(link)
+        self._prices.append(price)
+
+    def build(self):
+        # Stable sort keeps each whisky's reviews in spreadsheet order
+        order = sorted(range(len(self._whiskies)), key=self._whiskies.__getitem__)
+        starts = array("I", [0] * (len(self._names) + 1))
+        for whisky in self._whiskies:
+            starts[whisky + 1] += 1
+        for pos in range(len(self._names)):
+            starts[pos + 1] += starts[pos]
+        names = list(self._names)
+        ratings = array("h", (self._ratings[row] for row in order))
+        dates = array("I", (self._dates[row] for row in order))
+        return ReviewStore(
+            names,
+            starts,
+            array("I", (self._whiskies[row] for row in order)),
+            list(self._usernames),
+            array("I", (self._user_idx[row] for row in order)),
+            ratings,
+            dates,
+            array("I", (self._review_ids[row] for row in order)),
+            StringTable.from_strings(self._links[row] for row in order),
+            StringTable.from_strings(self._prices[row] for row in order),
+            array("I", sorted(range(len(names)), key=names.__getitem__)),
+            **aggregate(starts, ratings, dates),
+        )
+
+
+def aggregate(starts, ratings, dates):
+    """Compute the per-whisky aggregate columns of a ReviewStore in one pass over the rows."""
+    columns = {
+        "recent": array("I"),
+        "rated_counts": array("I"),
+        "means": array("d"),
+        "min_ratings": array("h"),
+        "max_ratings": array("h"),
+        "last_dates": array("I"),
+    }
+    for pos in range(len(starts) - 1):
+        rows = range(starts[pos], starts[pos + 1])
+        # Newest first, and for the same date the later spreadsheet row first
+        columns["recent"].extend(sorted(rows, key=lambda row: (dates[row], row), reverse=True))
+        # Unrated and zero ratings have never counted towards a whisky's average
+        scores = [ratings[row] for row in rows if ratings[row] and ratings[row] != NO_RATING]
+        columns["rated_counts"].append(len(scores))
+        columns["means"].append(sum(scores) / len(scores) if scores else 0.0)
+        columns["min_ratings"].append(min(scores) if scores else NO_RATING)
+        columns["max_ratings"].append(max(scores) if scores else NO_RATING)
+        columns["last_dates"].append(max((dates[row] for row in rows), default=0))
+    return columns